@@ -7,51 +7,176 @@
 #                            #
 ##############################
 
+import argparse
+from collections import deque
 import sys
 import os
+import time
 
 # Python管理ライブラリ
 import math
 import pygame
 from pygame.locals import *
 
-# Pygame初期化
-pygame.mixer.pre_init(44100, 16, 2, 1024)
-pygame.mixer.init()
-pygame.init()
+# 処理時間の計測
+from lib.Profiler import profiler
 
 # 自作ライブラリ
-from lib import DrawMethodTemplates
-from lib.GameSystem import *
-from lib.ColorTheme import *
+with profiler.measure("startup.import"):
+    from lib import Calibration, DrawMethodTemplates, PlaybackSpeed, Romautil
+    from lib.GameEngine import GameEngine
+    from lib.Replay import Replay
+    from lib.SongClock import SongClock
+    from lib.ScoreWatcher import ScoreWatcher
+    from lib.Preloader import Preloader
+    from lib.SongLibrary import SongLibrary
+    from lib.GameSystem import *
+    from lib.ColorTheme import *
 
 # FPS管理用インスタンスを生成
 fps_clock = pygame.time.Clock()
 
-
-def gs_specify_score():
+# タイミング調整のクリックの間隔[秒]と回数
+CALIBRATION_INTERVAL = 0.6
+CALIBRATION_CLICKS = 20
+
+# 描画のFPSと、描画が遅れているときに続けて飛ばしてよいフレーム数
+RENDER_FPS = 60
+MAX_FRAME_SKIP = 5
+
+# 曲選択で、カーソルがこの時間[秒]止まったら先読みを始める
+PRELOAD_DELAY = 0.3
+
+# 練習モードで、セクションの何秒前から曲を流すか
+PRACTICE_LEAD_IN = 1.0
+
+
+def parse_arguments():
+    """
+    コマンドライン引数を解析する。
+
+    :return: 解析結果
+    """
+    parser = argparse.ArgumentParser(description="Musical Typer")
+    parser.add_argument("score", nargs="?",
+                        help="譜面ファイル。ディレクトリを指定するか省略すると、その中(デフォルト: カレントディレクトリ)の曲から選ぶ")
+    parser.add_argument("--dirty-rect", action="store_true",
+                        help="変化した領域だけを画面に反映する(ソフトウェア描画の環境向け)")
+    parser.add_argument("--logic-hz", type=int, default=240,
+                        help="ゲームのロジックを進める頻度[Hz]。描画のFPSとは別に、この頻度で入力と判定を処理する")
+    parser.add_argument("--latency", type=float, metavar="MS",
+                        help="音が聞こえるまでの遅延[ミリ秒]。この分だけ判定を遅らせる"
+                             "(デフォルト: --calibrateでこのマシンに保存した値)")
+    parser.add_argument("--calibrate", action="store_true",
+                        help="メトロノームに合わせてタップし、遅延を測ってこのマシン用に保存する")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="再生速度({}～{}、デフォルト: 1)。曲は初回に変換して保存しておく".format(
+                            PlaybackSpeed.MIN_SPEED, PlaybackSpeed.MAX_SPEED))
+    parser.add_argument("--practice", action="store_true",
+                        help="セクションを選んで、そのセクションだけを繰り返し練習する")
+    parser.add_argument("--watch", action="store_true",
+                        help="プレイ中に譜面ファイルが保存されたら、曲を止めずに読み直す(譜面作成向け)")
+    parser.add_argument("--profile", nargs="?", const="profile.json", metavar="FILE",
+                        help="処理時間を計測し、終了時にJSONで書き出す(デフォルト: profile.json)")
+
+    options = parser.parse_args()
+
+    if options.logic_hz <= 0:
+        parser.error("--logic-hz must be greater than 0")
+
+    if not PlaybackSpeed.MIN_SPEED <= options.speed <= PlaybackSpeed.MAX_SPEED:
+        parser.error("--speed must be between {} and {}".format(PlaybackSpeed.MIN_SPEED, PlaybackSpeed.MAX_SPEED))
+
+    return options
+
+
+def gs_specify_score(options, preloader=None):
     # ----- [ ゲーム用の情報準備 ] -----
 
-    if len(sys.argv) < 2:
+    if options.score is None:
         raise RuntimeError("Song is not specified!")
-    elif not os.path.isfile(sys.argv[1]):
+    elif not os.path.isfile(options.score):
         raise FileNotFoundError("Specified path is not file, or not exists!")
     else:
         print("Game will start at soon. Stay tuned!")
 
-    # 譜面を読み込む
-    score_data = Score()
-    score_data.read_score(sys.argv[1])
+    # 譜面を読み込む(先読みが終わっていなければ、終わるまで進み具合を表示する)
+    if preloader is None or preloader.file_name != options.score or preloader.speed != options.speed:
+        preloader = Preloader(options.score, options.speed)
+    if not gs_loading(preloader):
+        # 読み込みを中止した
+        return None
+
+    score_data = preloader.score
+    try:
+        preloader.wait()
+        score_data.load_music()
+    except PlaybackSpeed.SpeedChangeError as e:
+        # 速度を変えられない曲
+        print("Failed to change playback speed: {}".format(e))
+        return None
+    except ScoreFormatError:
+        # 譜面のエラーなら、すべてのエラーと警告を表示する
+        if not score_data.has_error:
+            raise
+
+        gs_special_error_log(score_data, options.score)
+        return None
+    except (pygame.error, OSError, UnicodeError, LookupError) as e:
+        # 譜面や曲のファイルが開けない(曲選択から来た場合に、メニューごと落ちないようにする)
+        print("Failed to load song: {}".format(e))
+        return None
 
     return score_data
 
 
-def gs_main_routine(score_data: Score):
-    # ゲームに必要なインスタンスを生成
+def gs_loading(preloader):
+    ui = None
 
-    ui = Screen()
-    game_info = GameInfo(score_data)
-    keyboard_drawer = DrawingUtil.KeyboardDrawer(ui.screen, 193, ui.full_font, 40, 5, 2)
+    while not preloader.done.wait(1 / 60):
+        # すぐに終わる場合は何も表示しない
+        if ui is None:
+            ui = Screen()
+        w, h = ui.screen_size
+
+        # 待っている間も、ウィンドウが固まらないようにイベントは処理する
+        # (中止しても先読みは裏で続くので、曲選択に戻ってまた選べばそのまま使われる)
+        for event in pygame.event.get():
+            if event.type == QUIT:
+                # 曲選択にも終了を伝える
+                pygame.event.post(pygame.event.Event(QUIT))
+                return False
+            if event.type == KEYDOWN and event.key == K_ESCAPE:
+                return False
+
+        ui.screen.fill(BACKGROUND_COLOR)
+
+        ui.print_str(MARGIN - 10, 0, ui.alphabet_font, "読み込み中...", TEXT_COLOR)
+        ui.print_str(MARGIN - 10, 60, ui.system_font, preloader.file_name, TEXT_COLOR)
+        DrawingUtil.write_limit(ui.screen, (w - 5, 60), w / 2, ui.system_font, "[Esc]／中止", TEXT_COLOR)
+
+        pygame.draw.line(ui.screen, more_whitish(TEXT_COLOR, 100), (0, 83), (w, 83), 2)
+
+        pygame.draw.rect(ui.screen, GREEN_THIN_COLOR, (MARGIN, 110, w - MARGIN * 2, 20))
+        pygame.draw.rect(ui.screen, more_blackish(GREEN_THIN_COLOR, 50),
+                         (MARGIN, 110, preloader.progress * (w - MARGIN * 2), 20))
+        DrawingUtil.write_center_x(ui.screen, w / 2, 108, ui.system_font,
+                                   "{:3.0f}％".format(preloader.progress * 100), TEXT_COLOR)
+
+        pygame.display.update()
+
+    return True
+
+
+def gs_main_routine(session: Session, options, section=-1):
+    # 画面・譜面・曲はセッションのものを使いまわし、ゲームの情報だけを最初に戻す
+    session.reset()
+
+    ui = session.ui
+    score_data = session.score
+    game_info = session.game_info
+    keyboard_drawer = session.keyboard_drawer
+    engine = GameEngine(game_info)
 
     # ループ管理用変数
     game_finished_reason = ""
@@ -68,38 +193,213 @@ def gs_main_routine(score_data: Score):
     is_tmp_next_lyrics_printing = False
     is_cont_next_lyrics_printing = False
 
-    # ランク決定用定数
-    rank_standard = [200, 150, 125, 100, 99.50, 99, 98, 97, 94, 90, 80, 60, 40, 20, 10, 0]
-    rank_string = ["Wow", "Unexpected", "Very God", "God", "Pro", "Genius", "Geki-tsuyo", "tsuyotusyo", "AAA", "AA",
-                   "A", "B", "C", "D", "E", "F"]
+    # リプレイ
+    replay = Replay(score_data.file_hash)
+
+    # 練習するセクションの(開始時間, 終了時間)と、繰り返した回数(練習モードでなければNone)
+    practice_range = score_data.get_section_range(section) if section != -1 else None
+    practice_loop = 0
+
     # ----- [ ゲーム準備 ] -----
 
+    # 曲上の位置はすべてこの時計から取る
+    clock = SongClock(score_data.offset, options.latency / 1000)
+
+    # ロジックを進める間隔と、進めた回数
+    logic_interval = 1 / options.logic_hz
+    render_interval = 1 / RENDER_FPS
+    logic_tick = 0
+
+    # 押されたキーと、その時間[ns]
+    key_queue = deque()
+
+    def start_practice_loop():
+        """
+        練習するセクションの少し前から曲を流し直し、セクションの開始時間からゲームをやり直す。
+
+        :return: 曲を途中から流せなかった場合はFalse
+        """
+        nonlocal logic_tick
+
+        start, end = practice_range
+        music_start = max(0, start - PRACTICE_LEAD_IN + score_data.offset)
+
+        try:
+            pygame.mixer.music.play(0, music_start)
+        except pygame.error as e:
+            # pygame 1.9ではWAVを途中から再生できない
+            print("Practice mode is not available for this song: {}".format(e))
+            return False
+        clock.start(music_start)
+
+        # ロジックはセクションの開始時間から進める(それまでに押されたキーは開始時間に押したことにする)
+        game_info.seek(start)
+        logic_tick = math.floor(start / logic_interval)
+        key_queue.clear()
+
+        ui.add_fg_effector(60, "Practice", DrawMethodTemplates.slide_fadeout_text,
+                           ["Loop {}".format(practice_loop + 1), (255, 127, 0), ui.system_font, 25, 0, 230])
+
+        return True
+
     # 再生
     pygame.mixer.music.set_volume(0.5)
-    pygame.mixer.music.play(1)
+    if practice_range is not None:
+        if not start_practice_loop():
+            return False
+    else:
+        pygame.mixer.music.play(1)
+        clock.start()
+        game_info.pos = 0
 
-    game_info.pos = 0
+    # 譜面の変更を監視するか／プレイ中に譜面を読み直したか
+    watcher = ScoreWatcher(options.score) if options.watch else None
+    score_reloaded = False
 
-    # メインループ
-    # (何らかの理由で強制的にメインループを抜ける必要が出てきた or 曲が終わった)
-    while mainloop_continues and pygame.mixer.music.get_pos() >= 0:
+    # 次に描画する時間と、続けて描画を飛ばした回数
+    next_render = time.perf_counter()
+    skipped_frames = 0
 
-        # -----------------
-        #    事前計算
-        # -----------------
+    def advance_to(pos):
+        """
+        曲上の指定した時間まで進め、歌詞・セクションの変化を反映する。
 
-        # フレームカウンタを更新
-        frame_count = (frame_count + 1) % 60
-        # 曲上の現在位置を把握
-        game_info.pos = pygame.mixer.music.get_pos() / 1000
+        :param pos: 曲上の時間
+        :return: なし
+        """
+        engine.update(pos)
+
+        # ===== 歌詞情報が変化したときの処理 =====
+
+        # 歌詞が変わった?
+        if engine.lyrics_changed:
+
+            # TLEした?
+            if engine.is_tle:
+                ui.add_fg_effector(30, "TLE", DrawMethodTemplates.slide_fadeout_text,
+                                   ["TLE", more_blackish(RED_COLOR, 50), ui.alphabet_font, -10,
+                                    -150, -383])
+                ui.add_bg_effector(15, "TLE", DrawMethodTemplates.blink_rect,
+                                   [more_whitish(RED_COLOR, 50), (0, 60, w, 130)])
+                SoundEffectConstants.tle.play()
+
+            # 曲が終わった?
+            if game_info.song_finished:
+                ui.add_bg_effector(60, "S.F.", DrawMethodTemplates.slide_fadeout_text,
+                                   ["Song Finished!", (255, 127, 0), ui.system_font, 25, 0, 0])
+
+        # セクションを全完した?
+        if engine.is_section_ac:
+            ui.add_bg_effector(60, "Section AC", DrawMethodTemplates.slide_fadeout_text,
+                               ["Section AC!", (255, 127, 0), ui.system_font, 25, 0, 0])
+
+    def reload_score():
+        """
+        変更された譜面を読み直し、曲を止めずにゲームに反映する。
 
-        # 現在の歌詞・ゾーン・セクションを取得
-        lyx_idx = game_info.update_current_lyrincs()
-        game_info.update_current_zone()
-        sct_idx = game_info.get_current_section()
+        :return: 譜面が変わった場合はTrue
+        """
+        try:
+            first_line = score_data.reparse_score(options.score)
+        except (OSError, ValueError) as e:
+            print("Failed to reload score: {}".format(e))
+            return False
+
+        if first_line == -1:
+            return False
+
+        game_info.resync_score()
+        clock.offset = score_data.offset
+
+        for level, line, text, column in score_data.log:
+            print("{} at line {}, column {}: {}".format("Error" if level == Score.LOG_ERROR else "Warning",
+                                                         line, column, text))
+
+        if score_data.has_error:
+            message, color = "Reloaded with errors", RED_COLOR
+        else:
+            message, color = "Reloaded from line {}".format(first_line), (255, 127, 0)
+
+        ui.add_fg_effector(120, "Reload", DrawMethodTemplates.slide_fadeout_text,
+                           [message, color, ui.system_font, 25, 0, 230])
+
+        return True
+
+    def judge_key(code):
+        """
+        タイプされたキーを、現在の時間で判定する。
+
+        :param code: タイプされたキー
+        :return: なし
+        """
+
+        # リプレイに記録する
+        replay.add_key(game_info.pos, code)
+
+        # 判定する
+        judgement = engine.type_key(code)
+
+        if judgement == GameEngine.KEY_SUCCESS:
+            got_point = engine.got_point
+
+            # 成功エフェクト
+            ui.add_fg_effector(30, "AC/WA", DrawMethodTemplates.slide_fadeout_text,
+                               ["Pass", more_blackish(GREEN_THIN_COLOR, 50), ui.alphabet_font, 10, -150,
+                                -383])
+
+            if not (is_cont_next_lyrics_printing or is_tmp_next_lyrics_printing):
+                # キーボード上に点数を描画する
+                x, y = keyboard_drawer.get_place(code)
+                x += keyboard_drawer.key_size / 2
+                x -= DrawingUtil.render_text(ui.full_font, "+{}".format(got_point), TEXT_COLOR).get_width() / 2
+                ui.add_fg_effector(30, code, DrawMethodTemplates.absolute_fadeout,
+                                   ["+{}".format(got_point), BLUE_THICK_COLOR, ui.full_font, 15, x, y])
+
+            # AC／WAのエフェクト
+            if game_info.is_ac:
+                ui.add_fg_effector(120, "AC/WA", DrawMethodTemplates.slide_fadeout_text,
+                                   ["AC", GREEN_THICK_COLOR, ui.alphabet_font, 20, -170, -383])
+                ui.add_bg_effector(15, "AC/WA", DrawMethodTemplates.blink_rect,
+                                   [more_whitish(GREEN_THIN_COLOR, 50), (0, 60, w, 130)])
+                SoundEffectConstants.ac.play()
+            elif game_info.is_wa:
+                ui.add_fg_effector(120, "AC/WA", DrawMethodTemplates.slide_fadeout_text,
+                                   ["WA", more_whitish(BLUE_THICK_COLOR, 100), ui.alphabet_font, 20, -170,
+                                    -383])
+                ui.add_bg_effector(15, "AC/WA", DrawMethodTemplates.blink_rect,
+                                   [more_whitish(BLUE_THICK_COLOR, 100), (0, 60, w, 130)])
+                SoundEffectConstants.wa.play()
+            else:
+                if game_info.is_in_zone and game_info.score.zone[game_info.zone_index]:
+                    SoundEffectConstants.special_success.play()
+                else:
+                    if game_info.get_key_per_second() > 4:
+                        SoundEffectConstants.fast.play()
+                    else:
+                        SoundEffectConstants.success.play()
+
+        elif judgement == GameEngine.KEY_FAILURE:
+            # 効果音を流す
+            SoundEffectConstants.failed.play()
+
+            # エフェクト
+            ui.add_bg_effector(15, "AC/WA", DrawMethodTemplates.blink_rect,
+                               [(255, 200, 200), (0, 60, w, 130)])
+            ui.add_fg_effector(30, "AC/WA", DrawMethodTemplates.slide_fadeout_text,
+                               ["MISS", more_whitish(RED_COLOR, 50), ui.alphabet_font,
+                                10, -150, -383])
+        else:
+            SoundEffectConstants.unneccesary.play()
+
+    # メインループ
+    # (何らかの理由で強制的にメインループを抜ける必要が出てきた or 曲が終わった)
+    # (練習モードでは、曲が先に終わってもセクションの終わりまで待って繰り返す)
+    while mainloop_continues and (clock.is_playing() or practice_range is not None):
+
+        profiler.begin_step()
 
         # ---------------------------
-        #   イベント処理／ジャッジ
+        #        イベント処理
         # ---------------------------
 
         # イベント処理ループ
@@ -126,128 +426,72 @@ def gs_main_routine(score_data: Score):
 
                 # 大前提として、無効なキーが押されていないか
                 if Romautil.is_readable_key_pressed(event.key):
+                    # 押された時間と一緒にロジックに渡す
+                    key_queue.append((time.perf_counter_ns(), chr(event.key)))
 
-                    # これ以上打つキーがない(打ち終わったか、そもそも歌詞がない)
-                    if game_info.completed:
-                        SoundEffectConstants.unneccesary.play()
-                        continue
+        profiler.lap("events")
 
-                    # 正しいキーが押されたか
-                    if game_info.is_expected_key(chr(event.key)):
-
-                        # 輪唱で初めての打鍵か
-                        if game_info.full[:1] and game_info.sent_count == 0:
-                            game_info.override_key_prev_pos()
-
-                        # 成功処理をする
-                        got_point = game_info.count_success()
-
-                        # 成功エフェクト
-                        ui.add_fg_effector(30, "AC/WA", DrawMethodTemplates.slide_fadeout_text,
-                                           ["Pass", more_blackish(GREEN_THIN_COLOR, 50), ui.alphabet_font, 10, -150,
-                                            -383])
-
-                        if not (is_cont_next_lyrics_printing or is_tmp_next_lyrics_printing):
-                            # キーボード上に点数を描画する
-                            x, y = keyboard_drawer.get_place(chr(event.key))
-                            x += keyboard_drawer.key_size / 2
-                            x -= ui.full_font.render("+{}".format(got_point), True, TEXT_COLOR).get_width() / 2
-                            ui.add_fg_effector(30, chr(event.key), DrawMethodTemplates.absolute_fadeout,
-                                               ["+{}".format(got_point), BLUE_THICK_COLOR, ui.full_font, 15, x, y])
-
-                        # AC／WAのエフェクト
-                        if game_info.is_ac:
-                            ui.add_fg_effector(120, "AC/WA", DrawMethodTemplates.slide_fadeout_text,
-                                               ["AC", GREEN_THICK_COLOR, ui.alphabet_font, 20, -170, -383])
-                            ui.add_bg_effector(15, "AC/WA", DrawMethodTemplates.blink_rect,
-                                               [more_whitish(GREEN_THIN_COLOR, 50), (0, 60, w, 130)])
-                            SoundEffectConstants.ac.play()
-                        elif game_info.is_wa:
-                            ui.add_fg_effector(120, "AC/WA", DrawMethodTemplates.slide_fadeout_text,
-                                               ["WA", more_whitish(BLUE_THICK_COLOR, 100), ui.alphabet_font, 20, -170,
-                                                -383])
-                            ui.add_bg_effector(15, "AC/WA", DrawMethodTemplates.blink_rect,
-                                               [more_whitish(BLUE_THICK_COLOR, 100), (0, 60, w, 130)])
-                            SoundEffectConstants.wa.play()
-                        else:
-                            if game_info.is_in_zone and game_info.score.zone[game_info.zone_index]:
-                                SoundEffectConstants.special_success.play()
-                            else:
-                                if game_info.get_key_per_second() > 4:
-                                    SoundEffectConstants.fast.play()
-                                else:
-                                    SoundEffectConstants.success.play()
-                    else:
-
-                        if not game_info.has_to_prevent_miss:
-                            # 失敗をカウントする
-                            game_info.count_failure()
-
-                            # 効果音を流す
-                            SoundEffectConstants.failed.play()
+        # ---------------------------
+        #      ロジック／ジャッジ
+        # ---------------------------
 
-                            # エフェクト
+        # 譜面が変更されていたら読み直す
+        if watcher is not None and watcher.poll() and reload_score():
+            score_reloaded = True
 
-                            ui.add_bg_effector(15, "AC/WA", DrawMethodTemplates.blink_rect,
-                                               [(255, 200, 200), (0, 60, w, 130)])
-                            ui.add_fg_effector(30, "AC/WA", DrawMethodTemplates.slide_fadeout_text,
-                                               ["MISS", more_whitish(RED_COLOR, 50), ui.alphabet_font,
-                                                10, -150, -383])
-                        else:
-                            SoundEffectConstants.unneccesary.play()
+        song_pos = clock.get_pos()
 
-        # ------------
-        #     計算
-        # ------------
+        # 練習モードでは、セクションの終わりまで来たら最初に戻る
+        if practice_range is not None and song_pos >= practice_range[1]:
+            practice_loop += 1
+            start_practice_loop()
+            song_pos = clock.get_pos()
 
-        # ===== 歌詞情報が変化したときの処理 =====
+        # キーは押された時間の曲上の位置で判定する
+        # その前に、押された時間までのロジックを進めておく
+        while key_queue:
+            key_ns, code = key_queue.popleft()
+            key_pos = max(clock.get_pos_at(key_ns / 1e9), game_info.pos)
 
-        # 歌詞が変わった?
-        if lyx_idx:
+            while (logic_tick + 1) * logic_interval <= key_pos:
+                logic_tick += 1
+                advance_to(logic_tick * logic_interval)
 
-            # TLEの計算をする
-            game_info.apply_TLE()
+            advance_to(key_pos)
+            judge_key(code)
 
-            # 最終的なタイプ情報を記録する
-            game_info.sentence_log.append([game_info.sent_count, game_info.sent_miss, game_info.completed])
+        # 曲上の現在位置まで、一定間隔でロジックを進める
+        # (時間は刻みの整数倍なので、処理が遅れても同じ時間で同じ順に進む)
+        while (logic_tick + 1) * logic_interval <= song_pos:
+            logic_tick += 1
+            advance_to(logic_tick * logic_interval)
 
-            # TLEした?
-            if len(game_info.target_roma) > 0 and not game_info.has_to_prevent_miss:
-                ui.add_fg_effector(30, "TLE", DrawMethodTemplates.slide_fadeout_text,
-                                   ["TLE", more_blackish(RED_COLOR, 50), ui.alphabet_font, -10,
-                                    -150, -383])
-                ui.add_bg_effector(15, "TLE", DrawMethodTemplates.blink_rect,
-                                   [more_whitish(RED_COLOR, 50), (0, 60, w, 130)])
-                SoundEffectConstants.tle.play()
-            else:
-                # 歌詞が変わるまでの待機時間を考慮して、前回のキータイプ時間を早める
-                game_info.override_key_prev_pos()
+        profiler.lap("logic")
 
-            # 歌詞をアップデートする
-            game_info.update_current_lyrics()
+        # ---------------
+        #   描画の判断
+        # ---------------
 
-            # 曲が終わった?
-            if game_info.song_finished:
-                # 歌詞情報を消去する
-                game_info.update_current_lyrics("", "")
-                ui.add_bg_effector(60, "S.F.", DrawMethodTemplates.slide_fadeout_text,
-                                   ["Song Finished!", (255, 127, 0), ui.system_font, 25, 0, 0])
+        # 描画する時間になるまでは、次のロジックか描画の時間まで待つ
+        now = time.perf_counter()
+        if now < next_render:
+            time.sleep(max(0, min(next_render - now, (logic_tick + 1) * logic_interval - song_pos)))
+            profiler.lap("tick_wait")
+            continue
 
-        # セクションが変わった?
-        if sct_idx:
+        next_render += render_interval
 
-            # セクションを全完した?
-            if game_info.section_miss == 0 and game_info.section_count != 0:
-                # エフェクトとボーナスポイント
-                ui.add_bg_effector(60, "Section AC", DrawMethodTemplates.slide_fadeout_text,
-                                   ["Section AC!", (255, 127, 0), ui.system_font, 25, 0, 0])
-                game_info.point += game_info.SECTION_PERFECT_POINT
+        # 1フレーム以上遅れているなら、MAX_FRAME_SKIP回までは描画を飛ばしてロジックと入力を優先する
+        if now > next_render and skipped_frames < MAX_FRAME_SKIP:
+            skipped_frames += 1
+            continue
 
-            # セクションごとのタイプ情報を記録
-            game_info.section_log.append([game_info.section_count, game_info.section_miss])
+        skipped_frames = 0
+        next_render = max(next_render, now)
 
-            # セクションのデータを削除
-            game_info.reset_section_score()
+        # フレームカウンタを更新
+        frame_count = (frame_count + 1) % 60
+        profiler.begin_frame()
 
         # ---------------
         #     画面描画
@@ -265,12 +509,15 @@ def gs_main_routine(score_data: Score):
                                 more_whitish(TEXT_COLOR, 100))
 
         # 残り時間ゲージ
+        gauge_width = math.floor(game_info.get_time_remain_ratio() * w)
         pygame.draw.rect(ui.screen, more_blackish(BACKGROUND_COLOR, 25), (0, 60, w, 130))
-        pygame.draw.rect(ui.screen, more_blackish(BACKGROUND_COLOR, 50),
-                         (0, 60, math.floor(game_info.get_time_remain_ratio() * w), 130))
+        pygame.draw.rect(ui.screen, more_blackish(BACKGROUND_COLOR, 50), (0, 60, gauge_width, 130))
+
+        profiler.lap("bg_draw")
 
         # レイヤーが変わるのでここで背景エフェクトを更新する
         ui.update_effector(1)
+        profiler.lap("bg_effectors")
 
         # ----- [ 前面レイヤー ] -----
 
@@ -287,7 +534,7 @@ def gs_main_routine(score_data: Score):
             ui.print_str(MARGIN - 12, 60, ui.full_font, printout_lyrics, more_whitish(TEXT_COLOR, 30))
 
         # コンボ
-        combo_text = ui.full_font.render(str(game_info.combo), True, more_whitish(TEXT_COLOR, 50))
+        combo_text = DrawingUtil.render_text(ui.full_font, str(game_info.combo), more_whitish(TEXT_COLOR, 50))
         ui.screen.blit(combo_text, (MARGIN - 12, 157))
         ui.print_str(combo_text.get_width() + 5, 165, ui.system_font, "chain", more_whitish(TEXT_COLOR, 75))
 
@@ -295,15 +542,22 @@ def gs_main_routine(score_data: Score):
         pygame.draw.rect(ui.screen, GREEN_THICK_COLOR if not game_info.is_ac else RED_COLOR,
                          (0, 60, w * game_info.get_sentence_accuracy(), 3))
         DrawingUtil.write_limit(ui.screen, (w * game_info.get_rate(limit=True), 168), 0, ui.system_font,
-                                rank_string[game_info.calculate_rank()], more_whitish(TEXT_COLOR, 100))
+                                RANK_STRING[game_info.calculate_rank()], more_whitish(TEXT_COLOR, 100))
 
         # 達成率ゲージ
         if game_info.calculate_rank() > 0:
-            acheive_rate = rank_standard[game_info.calculate_rank() - 1] / 100
+            acheive_rate = RANK_STANDARD[game_info.calculate_rank() - 1] / 100
             pygame.draw.rect(ui.screen, RED_COLOR, (0, 187, w * acheive_rate, 3))
         pygame.draw.rect(ui.screen, GREEN_THICK_COLOR if game_info.get_rate() < 0.8 else BLUE_THICK_COLOR,
                          (0, 187, w * game_info.get_rate(), 3))
 
+        # 歌詞・ゲージ類の領域が変化したか
+        ui.mark_dirty_if_changed((0, 60, w, 130), gauge_width, game_info.full, game_info.sent_count,
+                                 game_info.typed_roma, game_info.target_roma, game_info.combo,
+                                 int(w * game_info.get_sentence_accuracy()), game_info.is_ac,
+                                 int(w * game_info.get_rate(limit=True)), int(w * game_info.get_rate()),
+                                 game_info.calculate_rank())
+
         # キーボード
 
         if is_tmp_next_lyrics_printing or is_cont_next_lyrics_printing:
@@ -316,7 +570,7 @@ def gs_main_routine(score_data: Score):
                 if game_info.score.score[lyrics_index][1][:1] != "/":
                     ui.print_str(5, 210 + 60 * i, ui.full_font, game_info.score.score[lyrics_index][1], TEXT_COLOR)
                     ui.print_str(5, 230 + 60 * i, ui.system_font,
-                                 Romautil.hira2roma(game_info.score.score[lyrics_index][2]),
+                                 game_info.score.typing[lyrics_index].remaining_roma[0],
                                  more_whitish(TEXT_COLOR, 50))
         else:
             if game_info.has_to_prevent_miss:
@@ -325,15 +579,21 @@ def gs_main_routine(score_data: Score):
                 keyboard_drawer.draw(game_info.target_roma[:1],
                                      background_color=(192, 192, 192) if game_info.completed else None)
 
+        # キーボードの領域が変化したか
+        ui.mark_dirty_if_changed((0, 190, w, 185), is_tmp_next_lyrics_printing or is_cont_next_lyrics_printing,
+                                 game_info.lyrincs_index, game_info.has_to_prevent_miss,
+                                 game_info.target_roma[:1], game_info.completed)
+
         # 点数表示
         if game_info.point < 0:
             if frame_count % 20 < 10:
                 score_color = RED_COLOR
             else:
                 score_color = BLUE_THICK_COLOR
-            ui.print_str(5, 20, ui.alphabet_font, "{:08d}".format(game_info.point), score_color)
         else:
-            ui.print_str(5, 20, ui.alphabet_font, "{:08d}".format(game_info.point), BLUE_THICK_COLOR)
+            score_color = BLUE_THICK_COLOR
+        ui.print_str(5, 20, ui.alphabet_font, "{:08d}".format(game_info.point), score_color)
+        ui.mark_dirty_if_changed((0, 20, w // 2, 50), game_info.point, score_color)
 
         # --- リアルタイム情報 ---
         pygame.draw.line(ui.screen, more_whitish(TEXT_COLOR, 100), (0, 375), (w, 375), 2)
@@ -363,15 +623,29 @@ def gs_main_routine(score_data: Score):
         ui.print_str(MARGIN + 320, 430, ui.system_font, "達成率", more_whitish(TEXT_COLOR, 100))
         ui.print_str(MARGIN + 330, 430, ui.big_font, "{:05.1f}％".format(game_info.get_rate() * 100), BLUE_THICK_COLOR)
 
+        # リアルタイム情報の領域が変化したか
+        ui.mark_dirty_if_changed((0, 375, w, h - 375), "{:4.2f}".format(game_info.get_key_per_second()),
+                                 frame_count % 10 < 5, "{:05.1f}".format(game_info.get_full_accuracy() * 100),
+                                 "{:05.1f}".format(game_info.get_rate() * 100))
+
+        profiler.lap("fg_draw")
+
         # レイヤーが変わるのでここで前面エフェクトを更新する
         ui.update_effector(0)
+        profiler.lap("fg_effectors")
 
         # FPSカウンタ
-        ui.print_str(3, -3, ui.system_font, "{:5.2f} fps".format(fps_clock.get_fps()), TEXT_COLOR)
+        fps_text = "{:5.2f} fps".format(fps_clock.get_fps())
+        ui.print_str(3, -3, ui.system_font, fps_text, TEXT_COLOR)
+        ui.mark_dirty_if_changed((0, 0, 120, 20), fps_text)
+        profiler.lap("fps_counter")
 
         # ループ終わり
-        fps_clock.tick(60)
-        pygame.display.update()
+        fps_clock.tick()
+        ui.update_display()
+        profiler.lap("display_update")
+
+    profiler.end_loop()
 
     # メインループ終了
     print("*****************")
@@ -382,17 +656,34 @@ def gs_main_routine(score_data: Score):
 
     pygame.mixer.music.stop()
 
-    return game_info
+    # リプレイを保存する
+    # (途中で譜面が変わった場合は、どの譜面でも再現できないので保存しない)
+    if score_reloaded:
+        print("Replay is not saved because the score was reloaded")
+    elif practice_range is not None:
+        # 曲の最初から遊んでいないので、採点し直せない
+        print("Replay is not saved in practice mode")
+    elif score_data.speed != 1:
+        # 時間が元の譜面と合わないので、採点し直せない
+        print("Replay is not saved because the playback speed was changed")
+    else:
+        replay.end_time = game_info.pos
+        replay_file = replay.save()
+        if replay_file is not None:
+            print("Replay saved: " + replay_file)
+        else:
+            print("Failed to save replay")
 
+    return True
 
-def gs_result(game_info):
-    ui = Screen()
+
+def gs_result(session: Session):
+    ui = session.ui
+    game_info = session.game_info
+    score = session.score
     w, h = ui.screen_size
     mainloop_continues = True
     retry = False
-    rank_standard = [200, 150, 125, 100, 99.50, 99, 98, 97, 94, 90, 80, 60, 40, 20, 10, 0]
-    rank_string = ["Wow", "Unexpected", "Very God", "God", "Pro", "Genius", "Geki-tsuyo", "tsuyotusyo", "AAA", "AA",
-                   "A", "B", "C", "D", "E", "F"]
 
     while mainloop_continues:
         for event in pygame.event.get():
@@ -420,8 +711,8 @@ def gs_result(game_info):
         pygame.draw.line(ui.screen, more_whitish(TEXT_COLOR, 100), (0, 90), (w, 90), 2)
 
         ui.print_str(MARGIN, 85, ui.big_font,
-                     rank_string[game_info.calculate_rank()],
-                     more_blackish(RED_COLOR, 150 * (game_info.calculate_rank() + 1) / len(rank_standard)))
+                     RANK_STRING[game_info.calculate_rank()],
+                     more_blackish(RED_COLOR, 150 * (game_info.calculate_rank() + 1) / len(RANK_STANDARD)))
 
         ui.print_str(MARGIN, 150, ui.nihongo_font, "{:06.2f}％".format(game_info.get_rate() * 100),
                      tuple(x * game_info.get_full_accuracy() for x in RED_COLOR))
@@ -437,9 +728,9 @@ def gs_result(game_info):
                                    "{:4.2f} Char/sec".format(game_info.get_key_per_second()), TEXT_COLOR)
 
         if game_info.calculate_rank() > 0:
-            acheive_rate = rank_standard[game_info.calculate_rank() - 1] - game_info.get_rate() * 100
+            acheive_rate = game_info.get_next_rank_gap()
             ui.print_str(MARGIN + 200, 160, ui.system_font,
-                         "{} まで ".format(rank_string[game_info.calculate_rank() - 1]), BLUE_THICK_COLOR)
+                         "{} まで ".format(RANK_STRING[game_info.calculate_rank() - 1]), BLUE_THICK_COLOR)
             ui.print_str(MARGIN + 200, 168, ui.alphabet_font, "{:06.2f}% ".format(acheive_rate), BLUE_THICK_COLOR)
 
         ui.print_str(MARGIN, 240, ui.system_font, "正確率", more_whitish(TEXT_COLOR, 50))
@@ -460,12 +751,271 @@ def gs_result(game_info):
     return retry
 
 
+def gs_calibration():
+    ui = Screen()
+    w, h = ui.screen_size
+
+    # クリックの間隔と回数
+    interval = CALIBRATION_INTERVAL
+    click_count = CALIBRATION_CLICKS
+
+    click_times = []
+    tap_times = []
+
+    # 少し待ってから鳴らし始める
+    start_time = time.perf_counter() + 1
+    result = None
+
+    mainloop_continues = True
+    while mainloop_continues:
+        for event in pygame.event.get():
+            if event.type == QUIT:
+                return None
+            if event.type == KEYDOWN:
+                # ESCキーの場合
+                if event.key == K_ESCAPE:
+                    return None
+
+                if result is None:
+                    # タップした時間を記録する
+                    if event.key == K_SPACE:
+                        tap_times.append(time.perf_counter_ns() / 1e9)
+                elif event.key == K_RETURN:
+                    # 保存して終わる(保存できなくても、今回はこの値を使う)
+                    if not Calibration.save_latency(*result):
+                        print("Failed to save calibration to " + Calibration.CALIBRATION_FILE)
+                    return result[0]
+                elif event.key == K_r:
+                    # やり直す
+                    click_times = []
+                    tap_times = []
+                    start_time = time.perf_counter() + 1
+                    result = None
+
+        now = time.perf_counter()
+
+        # クリックを鳴らす
+        if len(click_times) < click_count and now >= start_time + len(click_times) * interval:
+            SoundEffectConstants.success.play()
+            click_times.append(time.perf_counter())
+
+        # 全部鳴らし終わったら計算する
+        if result is None and len(click_times) == click_count and now >= click_times[-1] + interval:
+            result = Calibration.calculate(click_times, tap_times, interval)
+            if result is None:
+                # タップが足りないのでやり直す
+                click_times = []
+                tap_times = []
+                start_time = now + 1
+
+        ui.screen.fill(BACKGROUND_COLOR)
+
+        ui.print_str(MARGIN - 10, 0, ui.alphabet_font, "タイミング調整", TEXT_COLOR)
+        ui.print_str(MARGIN - 10, 40, ui.system_font, "音に合わせてスペースキーを押してください", more_whitish(TEXT_COLOR, 50))
+
+        pygame.draw.line(ui.screen, more_whitish(TEXT_COLOR, 100), (0, 83), (w, 83), 2)
+
+        if result is None:
+            # 拍に合わせて点滅させる
+            if len(click_times) > 0 and now - click_times[-1] < 0.1:
+                pygame.draw.rect(ui.screen, more_whitish(BLUE_THICK_COLOR, 100), (0, 90, w, 130))
+
+            ui.print_str(MARGIN, 110, ui.nihongo_font, "{} / {}".format(len(click_times), click_count), TEXT_COLOR)
+        else:
+            latency, jitter, taps = result
+            ui.print_str(MARGIN, 90, ui.system_font, "遅延", more_whitish(TEXT_COLOR, 100))
+            ui.print_str(MARGIN + 5, 100, ui.big_font, "{:+.1f}ms".format(latency), BLUE_THICK_COLOR)
+            ui.print_str(MARGIN, 190, ui.system_font, "ばらつき", more_whitish(TEXT_COLOR, 100))
+            ui.print_str(MARGIN + 5, 200, ui.nihongo_font, "{:.1f}ms ({}回)".format(jitter, taps), TEXT_COLOR)
+
+            pygame.draw.line(ui.screen, more_whitish(TEXT_COLOR, 100), (0, 320), (w, 320), 2)
+            ui.print_str(MARGIN - 10, 320, ui.alphabet_font, "[Enter]／保存", TEXT_COLOR)
+            ui.print_str(MARGIN + 200, 320, ui.alphabet_font, "[R]／やり直し", TEXT_COLOR)
+            ui.print_str(MARGIN + 420, 320, ui.alphabet_font, "[Esc]／中止", TEXT_COLOR)
+
+        fps_clock.tick(120)
+        pygame.display.update()
+
+
+def gs_section_select(session: Session):
+    ui = session.ui
+    score = session.score
+    w, h = ui.screen_size
+
+    section_index = 0
+
+    # 一度に表示するセクションの数と、一番上に表示するセクションの番号
+    visible_count = (h - 90 - 30) // 30
+    scroll = 0
+
+    while True:
+        for event in pygame.event.get():
+            if event.type == QUIT:
+                return -1
+            if event.type == KEYDOWN:
+                # ESCキーの場合
+                if event.key == K_ESCAPE:
+                    return -1
+                if event.key == K_UP:
+                    section_index = max(0, section_index - 1)
+                if event.key == K_DOWN:
+                    section_index = min(section_index + 1, len(score.section) - 1)
+                if event.key == K_RETURN and len(score.section) > 0:
+                    return section_index
+
+        ui.screen.fill(BACKGROUND_COLOR)
+
+        ui.print_str(MARGIN - 10, 0, ui.alphabet_font, "練習するセクション", TEXT_COLOR)
+        ui.print_str(MARGIN - 10, 60, ui.system_font, score.properties["title"], TEXT_COLOR)
+
+        pygame.draw.line(ui.screen, more_whitish(TEXT_COLOR, 100), (0, 83), (w, 83), 2)
+
+        if len(score.section) == 0:
+            ui.print_str(MARGIN, 90, ui.full_font, "この譜面にはセクション(@)がありません", RED_COLOR)
+
+        # 選択しているセクションが見えるようにスクロールする
+        scroll = min(max(scroll, section_index - visible_count + 1), section_index)
+
+        for i in range(scroll, min(scroll + visible_count, len(score.section))):
+            y = 90 + 30 * (i - scroll)
+
+            if i == section_index:
+                pygame.draw.rect(ui.screen, more_blackish(BACKGROUND_COLOR, 25), (0, y, w, 30))
+
+            start, end = score.get_section_range(i)
+            ui.print_str(MARGIN, y, ui.full_font, score.section[i][1], TEXT_COLOR)
+            DrawingUtil.write_limit(ui.screen, (w - 5, y + 5), w / 2, ui.system_font,
+                                    "{}:{:04.1f} - {}:{:04.1f}".format(int(start) // 60, start % 60,
+                                                                       int(end) // 60, end % 60),
+                                    more_whitish(TEXT_COLOR, 50))
+
+        pygame.draw.line(ui.screen, more_whitish(TEXT_COLOR, 100), (0, h - 30), (w, h - 30), 2)
+        ui.print_str(MARGIN - 10, h - 25, ui.system_font, "[↑↓]／選択　[Enter]／練習　[Esc]／戻る", TEXT_COLOR)
+
+        fps_clock.tick(60)
+        pygame.display.update()
+
+
+def gs_song_select(directory, selected=None, speed=1.0, preloader=None):
+    ui = Screen()
+    w, h = ui.screen_size
+
+    # インデックスを更新する間は、固まったように見えないように表示しておく
+    ui.screen.fill(BACKGROUND_COLOR)
+    ui.print_str(MARGIN - 10, 0, ui.alphabet_font, "曲を探しています...", TEXT_COLOR)
+    pygame.display.update()
+
+    library = SongLibrary()
+    try:
+        with profiler.measure("library.update"):
+            scanned, removed = library.update(directory)
+        songs = library.get_songs(directory)
+    finally:
+        library.close()
+
+    print("Library updated: {} scanned, {} removed, {} songs".format(scanned, removed, len(songs)))
+
+    # 前に選んだ曲があれば、そこから選び始める
+    song_index = next((i for i, song in enumerate(songs) if song.path == selected), 0)
+
+    # カーソルを合わせている曲の先読み
+    # (選ばないかもしれない曲の速度を変えるのは重いので、譜面と元の曲だけを読む。速度は選んでから変える)
+    # (一度に一曲だけ先読みし、終わるまでは次の曲の先読みを始めない)
+    hover_preloader = None
+
+    # 読み込みを中止して戻ってきた場合は、その先読みを使う
+    resumed_preloader = preloader if preloader is not None and preloader.speed == speed else None
+    cursor_moved = time.perf_counter()
+
+    # 一度に表示する曲の数と、一番上に表示する曲の番号
+    visible_count = (h - 90 - 30) // 45
+    scroll = 0
+
+    while True:
+        for event in pygame.event.get():
+            if event.type == QUIT:
+                return None, None
+            if event.type == KEYDOWN:
+                # ESCキーの場合
+                if event.key == K_ESCAPE:
+                    return None, None
+                if event.key == K_UP:
+                    song_index = max(0, song_index - 1)
+                    cursor_moved = time.perf_counter()
+                if event.key == K_DOWN:
+                    song_index = min(song_index + 1, len(songs) - 1)
+                    cursor_moved = time.perf_counter()
+                if event.key == K_RETURN and len(songs) > 0:
+                    # エラーのある譜面は遊べない
+                    if songs[song_index].has_error:
+                        SoundEffectConstants.unneccesary.play()
+                        continue
+
+                    path = songs[song_index].path
+                    for candidate in (resumed_preloader, hover_preloader):
+                        if candidate is not None and candidate.file_name == path:
+                            return path, candidate
+                    return path, None
+
+        # カーソルがしばらく止まったら、その曲を先読みしておく
+        if len(songs) > 0 and time.perf_counter() - cursor_moved >= PRELOAD_DELAY:
+            path = songs[song_index].path
+            if hover_preloader is None or (hover_preloader.file_name != path and hover_preloader.is_done()):
+                hover_preloader = Preloader(path)
+
+        ui.screen.fill(BACKGROUND_COLOR)
+
+        ui.print_str(MARGIN - 10, 0, ui.alphabet_font, "曲を選んでください", TEXT_COLOR)
+        ui.print_str(MARGIN - 10, 60, ui.system_font, os.path.abspath(directory), TEXT_COLOR)
+        DrawingUtil.write_limit(ui.screen, (w - 5, 60), w / 2, ui.system_font, "{}曲".format(len(songs)), TEXT_COLOR)
+
+        pygame.draw.line(ui.screen, more_whitish(TEXT_COLOR, 100), (0, 83), (w, 83), 2)
+
+        if len(songs) == 0:
+            ui.print_str(MARGIN, 90, ui.full_font, "譜面(*.tsc)が見つかりませんでした", RED_COLOR)
+
+        # 選択している曲が見えるようにスクロールする
+        scroll = min(max(scroll, song_index - visible_count + 1), song_index)
+
+        for i, song in enumerate(songs[scroll:scroll + visible_count]):
+            y = 90 + 45 * i
+
+            if scroll + i == song_index:
+                pygame.draw.rect(ui.screen, more_blackish(BACKGROUND_COLOR, 25), (0, y, w, 45))
+
+            ui.print_str(MARGIN, y, ui.full_font, song.title, RED_COLOR if song.has_error else TEXT_COLOR)
+            ui.print_str(MARGIN, y + 25, ui.system_font,
+                         "{}／{}".format(song.properties.get("song_author", "?"), song.properties.get("singer", "?")),
+                         more_whitish(TEXT_COLOR, 100))
+
+            if song.has_error:
+                info = "[エラー]"
+            else:
+                info = "{}:{:02d}  {}行  {:4.2f} Char/sec".format(int(song.duration) // 60, int(song.duration) % 60,
+                                                                 song.lyric_count, song.get_key_per_second())
+            DrawingUtil.write_limit(ui.screen, (w - 5, y + 25), w / 2, ui.system_font, info,
+                                    RED_COLOR if song.has_error else more_whitish(TEXT_COLOR, 50))
+
+        pygame.draw.line(ui.screen, more_whitish(TEXT_COLOR, 100), (0, h - 30), (w, h - 30), 2)
+        ui.print_str(MARGIN - 10, h - 25, ui.system_font, "[↑↓]／選択　[Enter]／プレイ　[Esc]／終了", TEXT_COLOR)
+
+        fps_clock.tick(60)
+        pygame.display.update()
+
+
 def gs_special_error_log(score_data, path):
     ui = Screen()
     w, h = ui.screen_size
 
     error_index = 0
 
+    # 一度に表示するログの数と、一番上に表示するログの番号
+    visible_count = (h - 90 - 30) // 45
+    scroll = 0
+
+    error_count = sum(1 for x in score_data.log if x[0] == Score.LOG_ERROR)
+    warn_count = len(score_data.log) - error_count
+
     mainloop_continues = True
     while mainloop_continues:
         for event in pygame.event.get():
@@ -487,26 +1037,111 @@ def gs_special_error_log(score_data, path):
         ui.print_str(MARGIN - 10, 0, ui.alphabet_font, "読み込みに失敗しました！", RED_COLOR)
         ui.print_str(MARGIN - 10, 35, ui.system_font, "譜面がおかしなことになっているようです:", RED_COLOR)
         ui.print_str(MARGIN - 10, 60, ui.system_font, path, TEXT_COLOR)
+        DrawingUtil.write_limit(ui.screen, (w - 5, 60), w / 2, ui.system_font,
+                                "エラー {}件／警告 {}件".format(error_count, warn_count), TEXT_COLOR)
 
         pygame.draw.line(ui.screen, more_whitish(TEXT_COLOR, 100), (0, 83), (w, 83), 2)
 
-        ui.print_str(MARGIN, 90, ui.system_font, score_data.log[0][1], TEXT_COLOR)
-        ui.print_str(MARGIN, 105, ui.alphabet_font, score_data.log[0][2], TEXT_COLOR)
+        # 選択しているログが見えるようにスクロールする
+        scroll = min(max(scroll, error_index - visible_count + 1), error_index)
 
-        pygame.draw.line(ui.screen, more_whitish(TEXT_COLOR, 100), (0, 160), (w, 160), 2)
+        for i, (level, line, text, column) in enumerate(score_data.log[scroll:scroll + visible_count]):
+            y = 90 + 45 * i
+
+            if scroll + i == error_index:
+                pygame.draw.rect(ui.screen, more_blackish(BACKGROUND_COLOR, 25), (0, y, w, 45))
+
+            if level == Score.LOG_ERROR:
+                ui.print_str(MARGIN, y, ui.system_font, "[エラー] {}行 {}列".format(line, column), RED_COLOR)
+            else:
+                ui.print_str(MARGIN, y, ui.system_font, "[警告] {}行 {}列".format(line, column), (255, 127, 0))
+            ui.print_str(MARGIN, y + 17, ui.full_font, text, TEXT_COLOR)
+
+        pygame.draw.line(ui.screen, more_whitish(TEXT_COLOR, 100), (0, h - 30), (w, h - 30), 2)
+        ui.print_str(MARGIN - 10, h - 25, ui.system_font, "[↑↓]／選択　[Esc]／終了", TEXT_COLOR)
 
         fps_clock.tick(60)
         pygame.display.update()
 
 
+def initialize():
+    """
+    Pygameを初期化し、効果音を読み込む。
+    曲の一覧を調べるプロセスはこのファイルを読み込み直すので、読み込んだだけでは初期化しないようにしている。
+
+    :return: なし
+    """
+    with profiler.measure("startup.pygame_init"):
+        pygame.mixer.pre_init(44100, 16, 2, 1024)
+        pygame.mixer.init()
+        pygame.init()
+
+    # 効果音はプレイ中に読み込むと処理が詰まるので、ここで全部読み込んでおく
+    with profiler.measure("startup.sounds"):
+        SoundEffectConstants.load()
+
+
 if __name__ == '__main__':
 
+    arguments = parse_arguments()
+
+    initialize()
+    if arguments.profile is not None:
+        profiler.enable(60)
+
     try:
-        score = gs_specify_score()
+        # タイミング調整をする
+        if arguments.calibrate:
+            calibrated_latency = gs_calibration()
+            if calibrated_latency is not None:
+                print("Latency calibrated: {:+.1f}ms".format(calibrated_latency))
+                arguments.latency = arguments.latency if arguments.latency is not None else calibrated_latency
+
+            # 譜面が指定されていなければ終わる
+            if arguments.score is None:
+                sys.exit(0)
+
+        # 遅延が指定されていなければ、このマシンで調整した値を使う
+        if arguments.latency is None:
+            arguments.latency = Calibration.load_latency() or 0
+
+        # 譜面ファイルではなくディレクトリが指定されたら、その中の曲から選ぶ
+        library_directory = None
+        if arguments.score is None or os.path.isdir(arguments.score):
+            library_directory = arguments.score or "."
+
+        preloader = None
+        while True:
+            if library_directory is not None:
+                arguments.score, preloader = gs_song_select(library_directory, arguments.score, arguments.speed,
+                                                            preloader)
+                if arguments.score is None:
+                    break
+
+            score = gs_specify_score(arguments, preloader)
+            if score is None:
+                # 曲選択から来た場合は、曲選択に戻る
+                if library_directory is None:
+                    sys.exit(1)
+                continue
 
-        loop_continues = True
-        while loop_continues:
-            game_result = gs_main_routine(score)
-            loop_continues = gs_result(game_result)
+            # リトライしても、画面・譜面・曲は読み込み直さない
+            session = Session(score, dirty_rect=arguments.dirty_rect)
+
+            # 練習モードなら、練習するセクションを選ぶ
+            practice_section = gs_section_select(session) if arguments.practice else -1
+
+            loop_continues = not arguments.practice or practice_section != -1
+            while loop_continues:
+                if not gs_main_routine(session, arguments, practice_section):
+                    break
+                loop_continues = gs_result(session)
+
+            if library_directory is None:
+                break
     finally:
         pygame.quit()
+
+        if arguments.profile is not None:
+            profiler.dump(arguments.profile)
+            print("Profile saved: " + arguments.profile)
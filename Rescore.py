@@ -0,0 +1,183 @@
+##############################
+#                            #
+#   loxygenK/musical_typer   #
+#   リプレイ一括再採点       #
+#   (c)2020 loxygenK         #
+#      All rights reversed.   #
+#                            #
+##############################
+
+import argparse
+import csv
+import multiprocessing
+import os
+import sys
+
+# 自作ライブラリ
+from lib import GameSystem, ScoreCache
+from lib.GameEngine import simulate
+from lib.GameSystem import GameInfo, Score, ScoreFormatError
+from lib.Replay import Replay, ReplayFormatError
+
+# ワーカープロセスごとの、譜面のハッシュと譜面ファイルの対応／読み込み済みの譜面
+score_paths = {}
+loaded_scores = {}
+
+
+def find_files(paths, extension):
+    """
+    指定したファイル、またはディレクトリ以下から、拡張子が一致するファイルを探す。
+
+    :param paths: ファイルまたはディレクトリのリスト
+    :param extension: 拡張子
+    :return: ファイルのリスト
+    """
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                found += [os.path.join(root, x) for x in sorted(files) if x.endswith(extension)]
+        else:
+            found.append(path)
+
+    return found
+
+
+def parse_overrides(overrides):
+    """
+    「名前=値」形式のGameInfoの定数の上書き指定を解析する。
+
+    :param overrides: 上書き指定のリスト
+    :return: 名前と値の辞書
+    """
+    parsed = {}
+    for override in overrides:
+        name, _, value = override.partition("=")
+        if not name.isupper() or not isinstance(getattr(GameInfo, name, None), (int, float)):
+            raise ValueError("Unknown GameInfo constant: " + name)
+
+        parsed[name] = type(getattr(GameInfo, name))(value)
+
+    return parsed
+
+
+def init_worker(paths, overrides, rank_standard):
+    """
+    ワーカープロセスを初期化する。定数の上書きはここでプロセスごとに行う。
+
+    :param paths: 譜面のハッシュと譜面ファイルの対応
+    :param overrides: GameInfoの定数の上書き
+    :param rank_standard: ランク決定用定数の上書き。Noneなら上書きしない
+    :return: なし
+    """
+    score_paths.update(paths)
+
+    for name, value in overrides.items():
+        setattr(GameInfo, name, value)
+
+    if rank_standard is not None:
+        GameSystem.set_rank_standard(rank_standard)
+
+
+def get_score(score_hash):
+    """
+    ハッシュに対応する譜面を取得する。プロセス内で一度読み込んだものは使いまわす。
+
+    :param score_hash: 譜面ファイルのSHA-1
+    :return: 譜面
+    """
+    if score_hash not in loaded_scores:
+        score = Score()
+        score.read_score(score_paths[score_hash], load_music=False)
+        loaded_scores[score_hash] = score
+
+    return loaded_scores[score_hash]
+
+
+def rescore(replay_path):
+    """
+    リプレイを一つ採点し直す。
+
+    :param replay_path: リプレイファイル
+    :return: 採点結果の辞書。採点できなかった場合はerrorに理由が入る
+    """
+    result = {"replay": replay_path}
+
+    try:
+        replay = Replay.load(replay_path)
+    except (OSError, ReplayFormatError) as e:
+        result["error"] = str(e)
+        return result
+
+    if replay.score_hash not in score_paths:
+        result["error"] = "Score not found: " + replay.score_hash.hex()
+        return result
+
+    try:
+        score = get_score(replay.score_hash)
+    except (OSError, ScoreFormatError) as e:
+        result["error"] = str(e)
+        return result
+
+    game_info = simulate(GameInfo(score), replay.keys, replay.end_time)
+
+    result["title"] = score.properties.get("title", "")
+    result["point"] = game_info.point
+    result["rate"] = game_info.get_rate()
+    result["accuracy"] = game_info.get_full_accuracy()
+    result["rank"] = GameSystem.RANK_STRING[game_info.calculate_rank()]
+    result["count"] = game_info.count
+    result["missed"] = game_info.missed
+
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="リプレイをまとめて採点し直し、ランキングを出力する")
+    parser.add_argument("replays", nargs="+", help="リプレイファイル、またはそれが入ったディレクトリ")
+    parser.add_argument("--scores", nargs="+", default=["."], help="譜面ファイル、またはそれが入ったディレクトリ")
+    parser.add_argument("--set", dest="overrides", action="append", default=[], metavar="NAME=VALUE",
+                        help="GameInfoの定数を上書きする (例: --set ONE_CHAR_POINT=12)")
+    parser.add_argument("--rank-standard", help="ランク決定用定数をカンマ区切りで上書きする")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="ワーカープロセスの数")
+    parser.add_argument("--output", help="ランキングを書き出すCSVファイル。省略すると標準出力")
+    arguments = parser.parse_args()
+
+    overrides = parse_overrides(arguments.overrides)
+
+    rank_standard = None
+    if arguments.rank_standard is not None:
+        rank_standard = [float(x) for x in arguments.rank_standard.split(",")]
+        if len(rank_standard) != len(GameSystem.RANK_STRING):
+            parser.error("--rank-standard needs {} values".format(len(GameSystem.RANK_STRING)))
+
+    # 譜面のハッシュから譜面ファイルを引けるようにする
+    paths = {}
+    for path in find_files(arguments.scores, ".tsc"):
+        paths.setdefault(ScoreCache.get_file_hash(path), path)
+
+    replays = find_files(arguments.replays, ".mtr")
+
+    with multiprocessing.Pool(arguments.workers, init_worker, (paths, overrides, rank_standard)) as pool:
+        results = list(pool.imap_unordered(rescore, replays, chunksize=max(1, len(replays) // (arguments.workers * 4))))
+
+    # エラーはまとめて報告する
+    for result in results:
+        if "error" in result:
+            print("{}: {}".format(result["replay"], result["error"]), file=sys.stderr)
+
+    ranking = sorted((x for x in results if "error" not in x), key=lambda x: x["rate"], reverse=True)
+
+    columns = ["replay", "title", "point", "rate", "accuracy", "rank", "count", "missed"]
+    output = open(arguments.output, mode="w", newline="", encoding="utf-8") if arguments.output else sys.stdout
+    try:
+        writer = csv.DictWriter(output, columns)
+        writer.writeheader()
+        writer.writerows(ranking)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == '__main__':
+    main()
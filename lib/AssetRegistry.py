@@ -0,0 +1,88 @@
+##############################
+#                            #
+#   loxygenK/musical_typer   #
+#   素材の遅延読み込み       #
+#   (c)2020 loxygenK         #
+#      All rights reversed.   #
+#                            #
+##############################
+
+import io
+
+import pygame
+
+from lib.Profiler import profiler
+
+# ゲームで使うフォント
+FONT_FILE = "mplus-1m-medium.ttf"
+
+
+class AssetRegistry:
+    """
+    フォントや効果音を読み込んで保持する。フォントははじめて使うときに読み込み、
+    フォントファイルは一度だけメモリに読み込んで、すべてのサイズで使いまわす。
+    """
+
+    def __init__(self):
+        self.font_data = {}
+        self.fonts = {}
+        self.sounds = {}
+
+    def get_font(self, size, file_name=FONT_FILE):
+        """
+        フォントを取得する。
+
+        :param size: サイズ
+        :param file_name: フォントファイル
+        :return: フォント
+        """
+        key = (file_name, size)
+        font = self.fonts.get(key)
+        if font is not None:
+            return font
+
+        with profiler.measure("assets.font"):
+            if not pygame.font.get_init():
+                pygame.font.init()
+
+            if file_name not in self.font_data:
+                with open(file_name, mode="rb") as f:
+                    self.font_data[file_name] = f.read()
+
+            # pygameはファイルを読みながら使うので、サイズごとに別のファイルオブジェクトを渡す
+            font = pygame.font.Font(io.BytesIO(self.font_data[file_name]), size)
+            self.fonts[key] = font
+
+        return font
+
+    def get_sound(self, file_name):
+        """
+        効果音を取得する。ミキサーは初期化されている必要がある。
+
+        :param file_name: 効果音ファイル
+        :return: 効果音
+        """
+        sound = self.sounds.get(file_name)
+        if sound is None:
+            with profiler.measure("assets.sound"):
+                sound = pygame.mixer.Sound(file_name)
+            self.sounds[file_name] = sound
+
+        return sound
+
+
+# ゲーム全体で共有するレジストリ
+registry = AssetRegistry()
+
+
+class LazyFont:
+    """
+    クラス属性として置くと、はじめてアクセスしたときにフォントを読み込む。
+    """
+
+    def __init__(self, size, file_name=FONT_FILE):
+        self.size = size
+        self.file_name = file_name
+
+    def __get__(self, instance, owner):
+        return registry.get_font(self.size, self.file_name)
@@ -0,0 +1,131 @@
+##############################
+#                            #
+#   loxygenK/musical_typer   #
+#   遅延の補正値             #
+#   (c)2020 loxygenK         #
+#      All rights reversed.   #
+#                            #
+##############################
+
+import json
+import math
+import os
+import socket
+import time
+from bisect import bisect_left
+
+# 補正値を保存するファイル
+CALIBRATION_FILE = "calibration.json"
+
+# 最初の何回のクリックを慣らしとして捨てるか
+LEAD_IN_CLICKS = 4
+
+# 計算に最低限必要なタップの数
+MIN_TAPS = 4
+
+
+def get_machine_name():
+    """
+    補正値を保存するときのマシンの名前を取得する。
+
+    :return: ホスト名
+    """
+    return socket.gethostname()
+
+
+def calculate(click_times, tap_times, interval):
+    """
+    クリックの時間とタップの時間から、遅延の平均とばらつきを求める。
+    タップは一番近いクリックに対応させ、クリックの間隔の半分以上ずれているものと、
+    慣らしのクリックに対するものは捨てる。
+
+    :param click_times: クリックを鳴らした時間[秒]のリスト(昇順)
+    :param tap_times: タップした時間[秒]のリスト
+    :param interval: クリックの間隔[秒]
+    :return: (遅延の平均[ミリ秒], 標準偏差[ミリ秒], 使ったタップの数)。タップが足りない場合はNone
+    """
+    if len(click_times) == 0:
+        return None
+
+    delays = []
+    for tap in tap_times:
+        # 一番近いクリックを探す
+        index = bisect_left(click_times, tap)
+        if index == len(click_times) or (index > 0 and tap - click_times[index - 1] < click_times[index] - tap):
+            index -= 1
+
+        delay = tap - click_times[index]
+        if index >= LEAD_IN_CLICKS and abs(delay) < interval / 2:
+            delays.append(delay)
+
+    if len(delays) < MIN_TAPS:
+        return None
+
+    mean = math.fsum(delays) / len(delays)
+    jitter = math.sqrt(math.fsum((x - mean) ** 2 for x in delays) / len(delays))
+
+    return mean * 1000, jitter * 1000, len(delays)
+
+
+def load_all(file_name=CALIBRATION_FILE):
+    """
+    保存されているすべてのマシンの補正値を読み込む。
+
+    :param file_name: 補正値のファイル
+    :return: マシンの名前と補正値の辞書。読み込めない場合は空
+    """
+    try:
+        with open(file_name, mode="r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+    return data if isinstance(data, dict) else {}
+
+
+def load_latency(file_name=CALIBRATION_FILE):
+    """
+    このマシンの遅延の補正値を読み込む。
+
+    :param file_name: 補正値のファイル
+    :return: 遅延[ミリ秒]。保存されていない場合はNone
+    """
+    entry = load_all(file_name).get(get_machine_name())
+    if not isinstance(entry, dict) or not isinstance(entry.get("latency"), (int, float)):
+        return None
+
+    return entry["latency"]
+
+
+def save_latency(latency, jitter, taps, file_name=CALIBRATION_FILE):
+    """
+    このマシンの遅延の補正値を保存する。ほかのマシンの補正値はそのまま残す。
+
+    :param latency: 遅延の平均[ミリ秒]
+    :param jitter: 遅延の標準偏差[ミリ秒]
+    :param taps: 計算に使ったタップの数
+    :param file_name: 補正値のファイル
+    :return: 保存できた場合はTrue
+    """
+    data = load_all(file_name)
+    data[get_machine_name()] = {
+        "latency": round(latency, 3),
+        "jitter": round(jitter, 3),
+        "taps": taps,
+        "date": time.strftime("%Y-%m-%d %H:%M:%S")
+    }
+
+    # 書いている途中で落ちても壊れないように、別のファイルに書いてから置き換える
+    temp_name = file_name + ".tmp"
+    try:
+        with open(temp_name, mode="w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(temp_name, file_name)
+    except OSError:
+        try:
+            os.remove(temp_name)
+        except OSError:
+            pass
+        return False
+
+    return True
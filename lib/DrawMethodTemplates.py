@@ -8,8 +8,12 @@
 ##################################
 import pygame
 
+from lib import DrawingUtil
 from lib.GameSystem import Screen
 
+# 点滅用のSurfaceと、塗りつぶした色の、大きさごとの対応
+filler_surfaces = {}
+
 
 def absolute_fadeout(current_frame, total_frame, ui: Screen, args):
     """
@@ -17,7 +21,7 @@ def absolute_fadeout(current_frame, total_frame, ui: Screen, args):
     """
     color = args[1] + (255 * (current_frame / total_frame),)
 
-    ui.print_str(args[4], args[5] - args[3] * (current_frame / total_frame), args[2], args[0], color)
+    return ui.print_str(args[4], args[5] - args[3] * (current_frame / total_frame), args[2], args[0], color)
 
 
 def slide_fadeout_text(current_frame, total_frame, ui: Screen, args):
@@ -28,16 +32,35 @@ def slide_fadeout_text(current_frame, total_frame, ui: Screen, args):
 
     color = args[1] + (255 * (current_frame / total_frame),)
 
-    text = args[2].render(args[0], True, color)
+    # 大きさを測るために描画したものをそのまま使う
+    text = DrawingUtil.render_text(args[2], args[0], color)
     text_w, text_h = text.get_size()
 
-    ui.print_str(
+    return ui.screen.blit(text, (
         (w - text_w) / 2 + args[4],
-        (h - text_h) / 2 + args[5] - args[3] * (current_frame / total_frame),
-        args[2],
-        args[0],
-        color
-    )
+        (h - text_h) / 2 + args[5] - args[3] * (current_frame / total_frame)
+    ))
+
+
+def get_filler(size, color):
+    """
+    点滅用の、単色で塗りつぶしたSurfaceを取得する。大きさごとに一つだけ作って使いまわす。
+
+    :param size: 大きさ
+    :param color: 色
+    :return: Surface。透明度はset_alpha()で変えること
+    """
+    filler = filler_surfaces.get(size)
+    if filler is None:
+        filler = [pygame.Surface(size), None]
+        filler_surfaces[size] = filler
+
+    # 色が変わったときだけ塗り直す
+    if filler[1] != color:
+        filler[0].fill(color)
+        filler[1] = color
+
+    return filler[0]
 
 
 def blink_screen(current_frame, total_frame, ui: Screen, args):
@@ -45,16 +68,9 @@ def blink_screen(current_frame, total_frame, ui: Screen, args):
     画面を一回点滅させる。
     """
 
-    color = args[0] + (255 - 255 * (current_frame / total_frame),)
-
-    alpha_info = pygame.Surface(ui.screen_size, pygame.SRCALPHA)
-    # TODO:46~50と64~68をまとめる
-    alpha_info.fill((255, 255, 255, 255 - 255 * (current_frame / total_frame)), special_flags=pygame.BLEND_RGBA_MULT)
-    filler = pygame.Surface(ui.screen_size)
-    filler.fill(color)
+    filler = get_filler(ui.screen_size, args[0])
     filler.set_alpha(255 - 255 * (current_frame / total_frame))
-    filler.blit(alpha_info, (0, 0))
-    ui.screen.blit(filler, (0, 0))
+    return ui.screen.blit(filler, (0, 0))
 
 
 def blink_rect(current_frame, total_frame, ui: Screen, args):
@@ -62,17 +78,9 @@ def blink_rect(current_frame, total_frame, ui: Screen, args):
     画面の指定した領域を一回点滅させる。
     """
 
-    color = args[0] + (255 - 255 * (current_frame / total_frame),)
-
-    size = (args[1][2], args[1][3])
-
-    alpha_info = pygame.Surface(size, pygame.SRCALPHA)
-    alpha_info.fill((255, 255, 255, 255 - 255 * (current_frame / total_frame)), special_flags=pygame.BLEND_RGBA_MULT)
-    filler = pygame.Surface(size)
-    filler.fill(color)
+    filler = get_filler((args[1][2], args[1][3]), args[0])
     filler.set_alpha(255 - 255 * (current_frame / total_frame))
-    filler.blit(alpha_info, (0, 0))
-    ui.screen.blit(filler, (args[1][0], args[1][1]))
+    return ui.screen.blit(filler, (args[1][0], args[1][1]))
 
 
 def print_text(_, __, ui: Screen, args):
@@ -80,7 +88,7 @@ def print_text(_, __, ui: Screen, args):
     画面に文字列を表示する。
     """
 
-    ui.print_str(args[0], args[1], args[2], args[3], args[4])
+    return ui.print_str(args[0], args[1], args[2], args[3], args[4])
 
 
 def faded_text(current_frame, total_frame, ui: Screen, args):
@@ -88,4 +96,4 @@ def faded_text(current_frame, total_frame, ui: Screen, args):
     指定した位置から動かずにフェードアウトしていく文字列を表示する。
     """
 
-    ui.print_str(args[0], args[1], args[2], args[3], (*args[4], 255 * (current_frame / total_frame)))
+    return ui.print_str(args[0], args[1], args[2], args[3], (*args[4], 255 * (current_frame / total_frame)))
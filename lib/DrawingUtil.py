@@ -1,5 +1,6 @@
+from collections import OrderedDict
+
 import pygame
-from PIL import Image, ImageDraw
 from math import tan, radians
 
 from lib.ColorTheme import *
@@ -14,9 +15,174 @@ from lib.ColorTheme import *
 #                            #
 ##############################
 
+# pygame 2からは、ピクセルごとの透明度を持つSurfaceにもset_alpha()が効く
+SURFACE_ALPHA_SUPPORTED = pygame.version.vernum[0] >= 2
+
+
+class FadingText:
+    """
+    透明度を変えながら描画する文字列。
+    文字列は一度だけ描画し、フレームごとには透明度だけを変える。
+    """
+
+    def __init__(self, font, text, color=(255, 255, 255)):
+        """
+        文字列を描画する。
+
+        :param font: 描画に使用するフォント
+        :param text: 描画する文字列
+        :param color: 描画する色(透明度は含めない)
+        """
+        self.surface = font.render(text, True, color)
+
+        # set_alpha()が効かない場合は、毎回ここに写して透明度を掛ける
+        self.work = None if SURFACE_ALPHA_SUPPORTED else self.surface.copy()
+
+    def get_surface(self, transparency):
+        """
+        透明度を設定したSurfaceを取得する。
+
+        :param transparency: 透明度(0で不透明、255で透明)
+        :return: Surface。次にget_surface()を呼ぶまでに使うこと
+        """
+        alpha = 255 - transparency
+
+        if self.work is None:
+            self.surface.set_alpha(alpha)
+            return self.surface
+
+        self.work.fill((0, 0, 0, 0))
+        self.work.blit(self.surface, (0, 0), special_flags=pygame.BLEND_RGBA_MAX)
+        self.work.fill((255, 255, 255, alpha), special_flags=pygame.BLEND_RGBA_MULT)
+        return self.work
+
+
+class TextCache:
+    """
+    描画済み文字列のキャッシュ。
+    フォント・文字列・色ごとにSurfaceを保持し、
+    容量を超えたら一番長く使われていないものから捨てる。
+    透明度付きの文字列はFadingTextとして保持し、透明度が変わっても描画し直さない。
+    """
+
+    def __init__(self, capacity=512):
+        """
+        キャッシュを初期化する。
+
+        :param capacity: 保持するSurfaceの最大数
+        """
+        self.capacity = capacity
+        self.surfaces = OrderedDict()
+        self.fading_texts = OrderedDict()
+
+        # ヒット／ミスの回数
+        self.hit_count = 0
+        self.miss_count = 0
+
+    @property
+    def hit_rate(self):
+        """
+        キャッシュのヒット率。
+
+        :return: ヒット回数/(ヒット回数+ミス回数)。一度も使われていない場合は0
+        """
+        total = self.hit_count + self.miss_count
+        return self.hit_count / total if total > 0 else 0
+
+    def render(self, font, text, color=(255, 255, 255)):
+        """
+        文字列を描画したSurfaceを取得する。
+        色が4要素の場合、4番目は透明度(0で不透明、255で透明)として扱う。
+
+        :param font: 描画に使用するフォント
+        :param text: 描画する文字列
+        :param color: 描画する色
+        :return: 文字列を描画したSurface。キャッシュと共有しているので書き換えないこと。
+                 透明度付きの場合は、次に同じ文字列を描画するまでに使うこと
+        """
+
+        # 毎フレーム少しずつ変わる色でキャッシュがあふれないように整数にする
+        color = tuple(int(x) for x in color)
+
+        if len(color) == 4:
+            return self.get_fading_text(font, text, color[:3]).get_surface(color[3])
+
+        key = (font, text, color)
+
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.hit_count += 1
+            self.surfaces.move_to_end(key)
+            return surface
+
+        self.miss_count += 1
+
+        surface = font.render(text, True, color)
+
+        self.surfaces[key] = surface
+        if len(self.surfaces) > self.capacity:
+            self.surfaces.popitem(last=False)
+
+        return surface
+
+    def get_fading_text(self, font, text, color=(255, 255, 255)):
+        """
+        透明度を変えながら描画する文字列を取得する。
+
+        :param font: 描画に使用するフォント
+        :param text: 描画する文字列
+        :param color: 描画する色(透明度は含めない)
+        :return: FadingText
+        """
+        key = (font, text, color)
+
+        fading_text = self.fading_texts.get(key)
+        if fading_text is not None:
+            self.hit_count += 1
+            self.fading_texts.move_to_end(key)
+            return fading_text
+
+        self.miss_count += 1
+
+        fading_text = FadingText(font, text, color)
+
+        self.fading_texts[key] = fading_text
+        if len(self.fading_texts) > self.capacity:
+            self.fading_texts.popitem(last=False)
+
+        return fading_text
+
+    def clear(self):
+        """
+        キャッシュを消去する。ヒット／ミスの回数はそのまま。
+
+        :return: なし
+        """
+        self.surfaces.clear()
+        self.fading_texts.clear()
+
+
+# 描画関数で共有するキャッシュ
+text_cache = TextCache()
+
+
+def render_text(font, text, color=(255, 255, 255)):
+    """
+    共有キャッシュを使って文字列を描画したSurfaceを取得する。
+
+    :param font: 描画に使用するフォント
+    :param text: 描画する文字列
+    :param color: 描画する色
+    :return: 文字列を描画したSurface。書き換えないこと
+    """
+    return text_cache.render(font, text, color)
+
+
 class KeyboardDrawer:
     """
-    キーボード描画クラス
+    キーボード描画クラス。
+    キーボード全体は背景色ごとに一枚のSurfaceに描画しておき、
+    ハイライトされたキーだけを上に重ねる。
     """
     keyboard = ["1234567890-\\^", "qwertyuiop@[", "asdfghjkl;:]", "zxcvbnm,./\\"]
     highlight_text = "fj"
@@ -40,21 +206,114 @@ class KeyboardDrawer:
         self.key_margin = key_margin
         self.width = width
         self.background_color = background_color
-        pass
+
+        # 描画済みのキーボード／ハイライトされたキー
+        self.layers = {}
+        self.overlays = {}
+
+        # キーの文字から位置を引けるようにしておく
+        self.key_places = self.get_key_places(screen.get_width(), key_size, key_margin)
+        self.places = {k: (v[0][0], start_y + v[0][1]) for k, v in self.key_places.items()}
 
     def get_place(self, key_char):
-        w, h = pygame.display.get_surface().get_size()
-        size = self.key_size + self.key_margin
+        """
+        キーの左上の座標を取得する。
+
+        :param key_char: キーの文字
+        :return: (X, Y)。キーボード上にない場合はNone
+        """
+        return self.places.get(key_char)
+
+    def get_key_places(self, screen_width, key_size, key_margin):
+        """
+        キーボードの上端からの、キーの文字ごとの左上の座標を求める。
+
+        :param screen_width: 描画対象ウィンドウの横幅
+        :param key_size: 一つ一つのキーの大きさ
+        :param key_margin: キーの間の余白
+        :return: キーの文字をキー、座標(X, Y)のリストを値とした辞書
+        """
+        places = {}
+        size = key_size + key_margin
         for i in range(4):
             key = self.keyboard[i]
-            start = (w - size * len(key)) / 2
-            index = key.find(key_char)
-            if index != -1:
-                y = self.start_y + i * size
-                x = start + index * size
-                return x, y
+            start = (screen_width - size * len(key)) / 2
+            for j in range(len(key)):
+                places.setdefault(key[j], []).append((start + size * j, size * i))
+
+        return places
+
+    def draw_key(self, surface, x, y, key_char, font, key_size, width, background_color, is_highlight):
+        """
+        キーを一つ描画する。
+
+        :param surface: 描画先Surface
+        :param x: キーの左上X
+        :param y: キーの左上Y
+        :param key_char: キーの文字
+        :param font: キー文字に使用するフォント
+        :param key_size: キーの大きさ
+        :param width: キーの枠
+        :param background_color: キーの背景色
+        :param is_highlight: ハイライトするか
+        :return: なし
+        """
+        if is_highlight:
+            pygame.draw.rect(surface, GREEN_THICK_COLOR, (x, y, key_size, key_size), 0)
+        elif background_color is not None:
+            pygame.draw.rect(surface, background_color, (x, y, key_size, key_size), 0)
+
+        pygame.draw.rect(surface, TEXT_COLOR, (x, y, key_size, key_size), width)
+
+        color = TEXT_COLOR
+        if is_highlight:
+            color = invert_color(TEXT_COLOR)
+        elif key_char in self.highlight_text:
+            color = BLUE_THICK_COLOR
+
+        character = render_text(font, key_char.upper(), color)
+        surface.blit(character, (x + key_size // 2 - character.get_width() // 2,
+                                 y + key_size // 2 - character.get_height() // 2))
+
+    def get_layer(self, screen_width, font, key_size, key_margin, width, background_color):
+        """
+        キーボード全体を描画したSurfaceを取得する。初回だけ描画する。
+
+        :return: キーボード全体を描画したSurface
+        """
+        layer_key = (screen_width, font, key_size, key_margin, width, background_color)
+        layer = self.layers.get(layer_key)
+        if layer is not None:
+            return layer
+
+        size = key_size + key_margin
+        layer = pygame.Surface((screen_width, size * 4), pygame.SRCALPHA)
+        for key_char, places in self.get_key_places(screen_width, key_size, key_margin).items():
+            for x, y in places:
+                self.draw_key(layer, x, y, key_char, font, key_size, width, background_color, False)
+
+        if pygame.display.get_surface() is not None:
+            layer = layer.convert_alpha()
+
+        self.layers[layer_key] = layer
+        return layer
+
+    def get_overlay(self, key_char, font, key_size, width):
+        """
+        ハイライトされたキーを描画したSurfaceを取得する。初回だけ描画する。
+
+        :return: ハイライトされたキーを描画したSurface
+        """
+        overlay_key = (key_char, font, key_size, width)
+        overlay = self.overlays.get(overlay_key)
+        if overlay is not None:
+            return overlay
+
+        overlay = pygame.Surface((key_size, key_size))
+        self.draw_key(overlay, 0, 0, key_char, font, key_size, width, None, True)
 
-        return None
+        self.overlays[overlay_key] = overlay
+        return overlay
 
     # TODO: this line make short
     def draw(self, highlight="", *, screen=None, start_y=-1, font=None, key_size=-1, key_margin=-1, width=-1, background_color=(-1, -1, -1)):
@@ -74,49 +333,29 @@ class KeyboardDrawer:
 
         # フィールドから継承する値を取得する
         if screen           is None:         screen = self.screen
-        if start_y          is -1:           start_y = self.start_y
+        if start_y          == -1:           start_y = self.start_y
         if font             is None:         font = self.font
-        if key_size         is -1:           key_size = self.key_size
-        if key_margin       is -1:           key_margin = self.key_margin
-        if width            is -1:           width = self.width
+        if key_size         == -1:           key_size = self.key_size
+        if key_margin       == -1:           key_margin = self.key_margin
+        if width            == -1:           width = self.width
 
         if background_color is not None and background_color[0] == -1:
             background_color = self.background_color
 
-        w, h = pygame.display.get_surface().get_size()
-        size = key_size + key_margin
-        for i in range(4):
-            key = self.keyboard[i]
-            start = (w - size * len(key)) / 2
-            for j in range(len(key)):
-                is_highlight_needed = (highlight != "" and highlight.lower() == key[j].lower())
-                if is_highlight_needed:
-                    pygame.draw.rect(
-                        screen,
-                        GREEN_THICK_COLOR,
-                        (start + size * j, start_y + size * i, key_size, key_size),
-                        0
-                    )
-                elif background_color is not None:
-                    pygame.draw.rect(
-                        screen,
-                        background_color,
-                        (start + size * j, start_y + size * i, key_size, key_size),
-                        0
-                    )
-
-                pygame.draw.rect(screen, TEXT_COLOR,
-                                 (start + size * j, start_y + size * i, key_size, key_size), width)
-
-                color = TEXT_COLOR
-                if is_highlight_needed:
-                    color = invert_color(TEXT_COLOR)
-                elif key[j] in self.highlight_text:
-                    color = BLUE_THICK_COLOR
-
-                character = font.render(key[j].upper(), True, color)
-                # TODO: divide to some lines
-                screen.blit(character, (start + size * j + key_size // 2 - character.get_width() // 2, start_y + size * i + key_size // 2 - character.get_height() // 2))
+        screen_width = screen.get_width()
+        screen.blit(self.get_layer(screen_width, font, key_size, key_margin, width, background_color), (0, start_y))
+
+        if highlight == "":
+            return
+
+        key_char = highlight.lower()
+        if screen_width == self.screen.get_width() and key_size == self.key_size and key_margin == self.key_margin:
+            places = self.key_places.get(key_char, [])
+        else:
+            places = self.get_key_places(screen_width, key_size, key_margin).get(key_char, [])
+
+        for x, y in places:
+            screen.blit(self.get_overlay(key_char, font, key_size, width), (x, start_y + y))
 
 
 @DeprecationWarning
@@ -137,6 +376,9 @@ def arc(surface, color, pos, radius, start_angle, stop_angle):
     lu = (pos[0] - radius, int(pos[1] + tan(radians(135)) * radius))
     rd = (pos[0] + radius, int(pos[1] - tan(radians(-45)) * radius))
 
+    # Pillowは重いので、使うときまで読み込まない
+    from PIL import Image, ImageDraw
+
     im = Image.new("RGBA", (rd[0] - lu[0] + 1, rd[1] - lu[1]))
     draw = ImageDraw.Draw(im, "RGBA")
 
@@ -160,7 +402,7 @@ def write_limit(screen, pos, left_limit, font, string, color=TEXT_COLOR):
     :param y: 描画基準Y
     :return: なし
     """
-    rect_typed = font.render(string, True, color)
+    rect_typed = render_text(font, string, color)
 
     if rect_typed.get_width() > (pos[0] - left_limit):
         screen.blit(
@@ -193,7 +435,7 @@ def print_progress(screen, pos, left_limit, font, typed, remain, past_color=None
         remain_color = TEXT_COLOR
 
     write_limit(screen, pos, left_limit, font, typed, past_color)
-    rect_not_typed = font.render(remain, True, remain_color)
+    rect_not_typed = render_text(font, remain, remain_color)
     screen.blit(rect_not_typed, pos, (0, 0, (pos[0] - left_limit), rect_not_typed.get_height()))
 
 
@@ -210,7 +452,7 @@ def write_center_x(window, x, y, font, text, color=(255, 255, 255)):
     :return: なし
     """
 
-    rect = font.render(text, True, color)
+    rect = render_text(font, text, color)
     window.blit(rect, (x - rect.get_width() / 2, y))
 
 
@@ -224,14 +466,6 @@ def print_str(window, x, y, font, text, color=(255, 255, 255)):
     :param font: 描画に使用するフォント
     :param text: 描画する文字列
     :param color: 描画する文字列の色
-    :return: なし
+    :return: 描画した領域
     """
-    rect = font.render(text, True, color)
-    if len(color) == 4:
-        alpha_info = pygame.Surface(rect.get_size(), pygame.SRCALPHA)
-        alpha_info.fill((255, 255, 255, 255 - color[3]))
-        surf = rect.copy()
-        surf.blit(alpha_info, (0, 0), special_flags=pygame.BLEND_RGBA_MULT)
-        window.blit(surf, (x, y))
-    else:
-        window.blit(rect, (x, y))
+    return window.blit(render_text(font, text, color), (x, y))
@@ -0,0 +1,189 @@
+##############################
+#                            #
+#   loxygenK/musical_typer   #
+#   ゲーム進行エンジン       #
+#   (c)2020 loxygenK         #
+#      All rights reversed.   #
+#                            #
+##############################
+
+
+class GameEngine:
+    """
+    ゲームの進行(歌詞の切り替え・TLE・ログ・セクションボーナス・キーの判定)を扱う。
+    画面や音には一切触らないので、ウィンドウやミキサーがなくても動く。
+
+    1ステップは「時間を進める → 歌詞／セクションの変化を反映する → キーを判定する」の順に処理する。
+    歌詞が切り替わったときのキータイプ時間の上書きには歌詞の開始時間を使うので、
+    結果はステップを刻む間隔によらず、キーの時間と種類だけで決まる。
+    """
+
+    # キーの判定結果
+    KEY_UNNECESSARY = 0
+    KEY_SUCCESS = 1
+    KEY_FAILURE = 2
+
+    def __init__(self, game_info):
+        """
+        エンジンを初期化する。
+
+        :param game_info: 進行させるGameInfo
+        """
+        self.game_info = game_info
+
+        # 直前のupdate()で歌詞／セクションが変化したか
+        self.lyrics_changed = False
+        self.section_changed = False
+
+        # 直前のupdate()でTLEしたか／セクションを全完したか
+        self.is_tle = False
+        self.is_section_ac = False
+
+        # 直前のtype_key()で獲得した点数
+        self.got_point = 0
+
+    def update(self, pos):
+        """
+        時間を進め、歌詞／セクションの変化を反映する。
+
+        :param pos: 曲上の現在位置
+        :return: なし
+        """
+        game_info = self.game_info
+        game_info.pos = pos
+
+        # 現在の歌詞・ゾーン・セクションを取得
+        self.lyrics_changed = game_info.update_current_lyrincs()
+        game_info.update_current_zone()
+        self.section_changed = game_info.get_current_section()
+
+        self.is_tle = False
+        self.is_section_ac = False
+
+        if self.lyrics_changed:
+            self.apply_lyrics_change()
+
+        if self.section_changed:
+            self.apply_section_change()
+
+    def apply_lyrics_change(self):
+        """
+        歌詞が変化したときの処理をする。
+
+        :return: なし
+        """
+        game_info = self.game_info
+
+        # TLEの計算をする
+        game_info.apply_TLE()
+
+        # 最終的なタイプ情報を記録する
+        game_info.sentence_log.append([game_info.sent_count, game_info.sent_miss, game_info.completed])
+
+        # TLEした?
+        self.is_tle = len(game_info.target_roma) > 0 and not game_info.has_to_prevent_miss
+        if not self.is_tle:
+            # 歌詞が変わるまでの待機時間を考慮して、前回のキータイプ時間を歌詞の開始時間まで早める
+            score = game_info.score
+            game_info.override_key_prev_pos(score.score_time[score.get_lyrics_index(game_info.pos)])
+
+        # 歌詞をアップデートする
+        game_info.update_current_lyrics()
+
+        # 曲が終わったら歌詞情報を消去する
+        if game_info.song_finished:
+            game_info.update_current_lyrics("", "")
+
+    def apply_section_change(self):
+        """
+        セクションが変化したときの処理をする。
+
+        :return: なし
+        """
+        game_info = self.game_info
+
+        # セクションを全完した?
+        self.is_section_ac = game_info.section_miss == 0 and game_info.section_count != 0
+        if self.is_section_ac:
+            game_info.point += game_info.SECTION_PERFECT_POINT
+
+        # セクションごとのタイプ情報を記録
+        game_info.section_log.append([game_info.section_count, game_info.section_miss])
+
+        # セクションのデータを削除
+        game_info.reset_section_score()
+
+    def type_key(self, code):
+        """
+        タイプされたキーを判定する。
+
+        :param code: タイプされたキー
+        :return: 判定結果(KEY_UNNECESSARY, KEY_SUCCESS, KEY_FAILURE)
+        """
+        game_info = self.game_info
+
+        # これ以上打つキーがない(打ち終わったか、そもそも歌詞がない)
+        if game_info.completed:
+            return GameEngine.KEY_UNNECESSARY
+
+        # 正しいキーが押されたか
+        if game_info.is_expected_key(code):
+
+            # 輪唱で初めての打鍵か
+            if game_info.full[:1] and game_info.sent_count == 0:
+                game_info.override_key_prev_pos()
+
+            # 成功処理をする
+            self.got_point = game_info.count_success(code)
+            return GameEngine.KEY_SUCCESS
+
+        # 輪唱をまだタイプしていないなど、ミスにしてはいけない
+        if game_info.has_to_prevent_miss:
+            return GameEngine.KEY_UNNECESSARY
+
+        # 失敗をカウントする
+        game_info.count_failure()
+        return GameEngine.KEY_FAILURE
+
+    def step(self, pos, keys=()):
+        """
+        時間を進め、その時間に押されたキーを判定する。
+
+        :param pos: 曲上の現在位置
+        :param keys: その時間に押されたキーのリスト
+        :return: なし
+        """
+        self.update(pos)
+        for code in keys:
+            self.type_key(code)
+
+
+def simulate(game_info, key_stream, end_time=None):
+    """
+    ウィンドウもミキサーも使わずに、キー入力の記録から一曲分のゲームを進める。
+    歌詞／セクションの切り替わりとキーが押された時間だけをステップとして刻むので、
+    待つことなく一瞬で終わる。
+
+    :param game_info: 進行させる、まだ始まっていないGameInfo
+    :param key_stream: (曲上の時間, キー) のリスト
+    :param end_time: この時間で曲を終える。省略すると最後の歌詞の開始時間まで進める
+    :return: 進行し終わったgame_info
+    """
+    score = game_info.score
+    engine = GameEngine(game_info)
+
+    # 同じ時間に押されたキーはまとめて判定する
+    keys_at = {}
+    for pos, code in sorted(key_stream, key=lambda x: x[0]):
+        keys_at.setdefault(pos, []).append(code)
+
+    # 仮想時計が止まる時間
+    stops = set(score.score_time) | set(score.section_time) | set(keys_at.keys())
+    if end_time is not None:
+        stops = {x for x in stops if x <= end_time} | {end_time}
+
+    game_info.pos = 0
+    for pos in sorted(stops):
+        engine.step(pos, keys_at.get(pos, ()))
+
+    return game_info
@@ -7,13 +7,50 @@
 #                            #
 ##############################
 
-import re
+from bisect import bisect_left, bisect_right
 
-import chardet
 import pygame
-import romkan
 
-from lib import DrawingUtil, Romautil
+from lib import DrawingUtil, ScoreCache, ScoreParser
+from lib.AssetRegistry import LazyFont, registry
+from lib.Profiler import profiler
+from lib.RingBuffer import RingBuffer
+from lib.TypingAutomaton import TypingAutomaton
+
+# ランク決定用定数(達成率[%]がこれを超えたらそのランク)
+RANK_STANDARD = [200, 150, 125, 100, 99.50, 99, 98, 97, 94, 90, 80, 60, 40, 20, 10, 0]
+RANK_STRING = ["Wow", "Unexpected", "Very God", "God", "Pro", "Genius", "Geki-tsuyo", "tsuyotusyo", "AAA", "AA",
+               "A", "B", "C", "D", "E", "F"]
+
+# 二分探索用に昇順に並べたもの
+RANK_THRESHOLD = sorted(RANK_STANDARD)
+
+
+def set_rank_standard(standard):
+    """
+    ランク決定用定数を差し替える。
+
+    :param standard: 降順に並んだ達成率[%]のリスト
+    :return: なし
+    """
+    global RANK_STANDARD, RANK_THRESHOLD
+    RANK_STANDARD = list(standard)
+    RANK_THRESHOLD = sorted(RANK_STANDARD)
+
+
+def get_rank_by_rate(rate):
+    """
+    達成率からランクのIDを求める。
+
+    :param rate: 達成率
+    :return: ランクのID
+    """
+    # 達成率を下回る基準の数
+    passed = bisect_left(RANK_THRESHOLD, rate * 100)
+    if passed == 0:
+        return len(RANK_STANDARD) - 1
+
+    return len(RANK_STANDARD) - passed
 
 
 class ScoreFormatError(Exception):
@@ -24,24 +61,79 @@ class ScoreFormatError(Exception):
     pass
 
 
+class Effector:
+    """
+    エフェクター一つ分の情報。Screenがプールして使いまわす。
+    """
+
+    __slots__ = ("key", "living_frame", "current_frame", "draw_func", "argument")
+
+    def __init__(self):
+        self.key = None
+        self.living_frame = 0
+        self.current_frame = 0
+        self.draw_func = None
+        self.argument = None
+
+
 class Screen:
     """
     画面処理を簡単にするためのクラス。
     このクラスのインスタンスは画面そのものも持つ
+    フォントははじめて使うときに読み込まれる
     """
 
-    big_font = pygame.font.Font("mplus-1m-medium.ttf", 72)
-    nihongo_font = pygame.font.Font("mplus-1m-medium.ttf", 48)
-    alphabet_font = pygame.font.Font("mplus-1m-medium.ttf", 32)
-    full_font = pygame.font.Font("mplus-1m-medium.ttf", 24)
-    rank_font = pygame.font.Font("mplus-1m-medium.ttf", 20)
-    system_font = pygame.font.Font("mplus-1m-medium.ttf", 16)
+    big_font = LazyFont(72)
+    nihongo_font = LazyFont(48)
+    alphabet_font = LazyFont(32)
+    full_font = LazyFont(24)
+    rank_font = LazyFont(20)
+    system_font = LazyFont(16)
 
-    def __init__(self):
+    # あらかじめ用意しておくエフェクターの数(足りなくなったら増やす)
+    EFFECTOR_POOL_SIZE = 64
+
+    def __init__(self, dirty_rect=False):
+        """
+        画面を初期化する。
+
+        :param dirty_rect: 変化した領域だけを画面に反映するか
+        """
         self.screen = pygame.display.set_mode((640, 530))
-        self.effector: list = [{}, {}]
+
+        # 前面／背面の、生きているエフェクター(追加した順)と、(描画メソッド, セクション名)からの対応
+        self.effectors = [[], []]
+        self.effector_keys = [{}, {}]
+        self.effector_pool = [Effector() for _ in range(Screen.EFFECTOR_POOL_SIZE)]
         pygame.display.set_caption("Musical Typer")
 
+        # 画面に反映する領域
+        self.dirty_rect = dirty_rect
+        self.dirty_rects = []
+        self.full_update = True
+
+        # 領域ごとの前回の描画内容と、前回エフェクターが描画した領域
+        self.region_state = {}
+        self.effector_rects = [[], []]
+
+    def reset(self):
+        """
+        エフェクターと画面に反映する領域の情報を消し、次のフレームで画面全体を反映する。
+        画面はそのまま使いまわす。
+
+        :return: なし
+        """
+        for mode in range(2):
+            for effector in self.effectors[mode]:
+                self.release_effector(effector)
+            self.effectors[mode].clear()
+            self.effector_keys[mode].clear()
+            self.effector_rects[mode].clear()
+
+        self.dirty_rects.clear()
+        self.region_state.clear()
+        self.full_update = True
+
     @property
     def screen_size(self):
         """
@@ -53,15 +145,54 @@ class Screen:
     def print_str(self, x, y, font, text, color=(255, 255, 255)):
         """
         ウィンドウに文字を描画する。
+        色が4要素の場合、4番目は透明度(0で不透明、255で透明)として扱う。
+        透明度だけが変わる場合は描画し直さないので、フェードアウトに使っても軽い。
 
         :param x: X座標
         :param y: Y座標
         :param font: 描画に使用するフォント
         :param text: 描画する文字列
         :param color: 描画する色
+        :return: 描画した領域
+        """
+        return DrawingUtil.print_str(self.screen, x, y, font, text, color)
+
+    def mark_dirty(self, rect):
+        """
+        画面に反映する領域を追加する。
+
+        :param rect: 領域 (X, Y, 横幅, 縦幅)
         :return: なし
         """
-        DrawingUtil.print_str(self.screen, x, y, font, text, color)
+        self.dirty_rects.append(rect)
+
+    def mark_dirty_if_changed(self, rect, *state):
+        """
+        領域に描画した内容が前回から変化していたら、画面に反映する領域に追加する。
+
+        :param rect: 領域 (X, Y, 横幅, 縦幅)
+        :param state: 領域に描画した内容を決める値
+        :return: なし
+        """
+        key = tuple(rect)
+        if self.region_state.get(key) != state:
+            self.region_state[key] = state
+            self.dirty_rects.append(rect)
+
+    def update_display(self):
+        """
+        描画した内容を画面に反映する。
+        dirty_rectが有効な場合は、変化した領域だけを反映する。
+
+        :return: なし
+        """
+        if self.dirty_rect and not self.full_update:
+            pygame.display.update(self.dirty_rects)
+        else:
+            pygame.display.update()
+
+        self.dirty_rects.clear()
+        self.full_update = False
 
     def add_fg_effector(self, living_frame, section_name, draw_func, argument=None):
         """
@@ -72,14 +203,7 @@ class Screen:
         :param argument: 描画メソッドに渡す引数
         :return: なし
         """
-
-        # if draw_func.__name__ in self.fg_effector.keys() は遅い:/
-        try:
-            del self.effector[0][draw_func.__name__ + section_name]
-        except KeyError:
-            pass
-
-        self.effector[0].setdefault(draw_func.__name__ + section_name, [living_frame, 0, draw_func, argument])
+        self.add_effector(0, living_frame, section_name, draw_func, argument)
 
     def add_bg_effector(self, living_frame, section_name, draw_func, argument=None):
         """
@@ -90,14 +214,47 @@ class Screen:
         :param argument: 描画メソッドに渡す引数
         :return: なし
         """
+        self.add_effector(1, living_frame, section_name, draw_func, argument)
 
-        # if draw_func.__name__ in self.fg_effector.keys() は遅い:/
-        try:
-            del self.effector[1][draw_func.__name__ + section_name]
-        except KeyError:
-            pass
+    def add_effector(self, mode, living_frame, section_name, draw_func, argument=None):
+        """
+        エフェクターを追加する。同じ描画メソッドとセクション名のエフェクターがあれば置き換える。
+        :param mode: 0なら前面エフェクター、1なら背面エフェクター
+        :param living_frame: 生存時間
+        :param section_name: エフェクターのセクション名
+        :param draw_func: 描画メソッド
+        :param argument: 描画メソッドに渡す引数
+        :return: なし
+        """
+        key = (draw_func, section_name)
+        keys = self.effector_keys[mode]
+
+        # 置き換えるものは消す
+        old = keys.get(key)
+        if old is not None:
+            self.effectors[mode].remove(old)
+            self.release_effector(old)
 
-        self.effector[1].setdefault(draw_func.__name__ + section_name, [living_frame, 0, draw_func, argument])
+        effector = self.effector_pool.pop() if self.effector_pool else Effector()
+        effector.key = key
+        effector.living_frame = living_frame
+        effector.current_frame = 0
+        effector.draw_func = draw_func
+        effector.argument = argument
+
+        keys[key] = effector
+        self.effectors[mode].append(effector)
+
+    def release_effector(self, effector):
+        """
+        エフェクターをプールに戻す。
+        :param effector: エフェクター
+        :return: なし
+        """
+        effector.key = None
+        effector.draw_func = None
+        effector.argument = None
+        self.effector_pool.append(effector)
 
     def update_effector(self, mode: int):
         """
@@ -106,29 +263,46 @@ class Screen:
                      1なら背面エフェクターを更新する
         :return: なし
         """
-        key_list = list(self.effector[mode].keys())
-        for k in key_list:
-            self.effector[mode][k][2](
-                self.effector[mode][k][1],
-                self.effector[mode][k][0],
-                self,
-                self.effector[mode][k][3]
-            )
-            self.effector[mode][k][1] += 1
+        # 前回描画した領域は消すために反映する
+        effector_rects = self.effector_rects[mode]
+        self.dirty_rects.extend(effector_rects)
+        effector_rects.clear()
+
+        effectors = self.effectors[mode]
+        keys = self.effector_keys[mode]
+
+        # 生きているものを前に詰めながら更新する
+        alive = 0
+        for effector in effectors:
+            rect = effector.draw_func(effector.current_frame, effector.living_frame, self, effector.argument)
+
+            # 描画した領域がわからない場合は画面全体を反映する
+            if rect is None:
+                self.full_update = True
+            else:
+                effector_rects.append(rect)
+                self.dirty_rects.append(rect)
 
-            if self.effector[mode][k][1] > self.effector[mode][k][0]:
-                del self.effector[mode][k]
+            effector.current_frame += 1
+
+            if effector.current_frame > effector.living_frame:
+                del keys[effector.key]
+                self.release_effector(effector)
+            else:
+                effectors[alive] = effector
+                alive += 1
+
+        del effectors[alive:]
 
     @DeprecationWarning
     def get_font_by_size(self, size):
         """
-        フォントをサイズから取得する。なんかそれなりに重いので使わんほうがいい
-        使うなら何回も呼び出すんじゃなくて変数に入れるとかしよう
+        フォントをサイズから取得する。一度読み込んだサイズは使いまわされる
 
         :param size: サイズ
         :return: フォント
         """
-        return pygame.font.Font("mplus-1m-medium.ttf", size)
+        return registry.get_font(size)
 
 
 class GameInfo:
@@ -146,7 +320,25 @@ class GameInfo:
 
     IDEAL_TYPE_SPEED = 3.0
 
-    def __init__(self, score, key_length=100):
+    # タイピング速度を求めるのに使うキータイプの数
+    KEY_LOG_LENGTH = 100
+
+    def __init__(self, score, key_length=-1):
+
+        # 譜面データ(点数じゃない)
+        self.score = score
+
+        # タイピング速度を求めるのに使うキータイプの数
+        self.length = key_length if key_length != -1 else GameInfo.KEY_LOG_LENGTH
+
+        self.reset()
+
+    def reset(self):
+        """
+        譜面はそのままで、プレイの情報を最初の状態に戻す。リトライのときに使う。
+
+        :return: なし
+        """
 
         # 現在位置
         self.pos = 0
@@ -163,9 +355,6 @@ class GameInfo:
         # ゾーン内にいるか
         self.is_in_zone = False
 
-        # 譜面データ(点数じゃない)
-        self.score = score
-
         # 歌詞データ
         self.target_roma = ""
         self.target_kana = ""
@@ -173,6 +362,10 @@ class GameInfo:
         self.typed_roma = ""
         self.full = ""
 
+        # 歌詞のタイプ判定用オートマトンとその状態
+        self.typing = TypingAutomaton("")
+        self.typing_state = TypingAutomaton.START
+
         # 曲を通してのカウント／ミス
         self.count = 0
         self.missed = 0
@@ -199,13 +392,16 @@ class GameInfo:
         self.completed = True
 
         # キータイプログ
-        self.key_log = []
+        self.key_log = RingBuffer(self.length)
         self.prev_time = 0
-        self.length = key_length
 
         # コンボ
         self.combo = 0
 
+        # 達成率などの計算結果と、計算したときの (成功回数, 失敗回数, 点数, 理想の点数)
+        self.stats = None
+        self.stats_key = None
+
     # ----- プロパティ -----
 
     # *** タイプ情報 ***
@@ -217,12 +413,7 @@ class GameInfo:
         :return: すでに打ったローマ字
         """
 
-        typed_index = self.full_kana.rindex(self.target_kana)
-
-        if len(self.target_kana) > 0:
-            return self.full_kana[:typed_index]
-        else:
-            return self.full_kana
+        return self.full_kana[:self.typing.kana_position[self.typing_state]]
 
     @property
     def typed(self):
@@ -295,8 +486,9 @@ class GameInfo:
     def update_current_lyrincs(self):
         """
         与えられた時間に置いて打つべき歌詞のデータを求める。
+        Score.get_lyrics_index()で二分探索するので、posが巻き戻っても正しく求められる。
 
-        :return: データ, lyrincs_indexが変化したか
+        :return: lyrincs_indexが変化したか
         """
 
         # 歌詞がない場合は無条件に終了する
@@ -304,120 +496,119 @@ class GameInfo:
             self.song_finished = True
             return False
 
-        # 一番最後の歌詞かどうか
-        if self.song_finished:
+        index = self.score.get_lyrics_index(self.pos)
+
+        # 最後の歌詞(終端)の開始時間を過ぎた
+        if index >= len(self.score.score) - 1:
             # 一番最後からは変化しない
-            return False
-        else:
-            # 現在の歌詞がすでに終わっているか(次の歌詞の開始時間を過ぎているか)
-            if self.score.score[self.lyrincs_index + 1][0] > self.pos:
+            if self.song_finished:
                 return False
 
-        # 次の歌詞を探す
-        #             pos i
-        #              ↓ |
-        # ---|//(i-1)/////|-----(i)-----|---
-        #     └→ここが引っかかる
-        for i in range(self.lyrincs_index, len(self.score.score)):
-            if i < 0:
-                continue
-
-            # i番目の歌詞の開始時間がposを超えているか
-            if self.score.score[i][0] > self.pos:
-
-                # 歌詞が変わっているか
-                is_lidx_changes = i - 1 != self.lyrincs_index
-                if is_lidx_changes:
-                    # 更新する
-                    self.lyrincs_index = i - 1
-
-                # 歌詞が変わっているかどうかを返す
-                return is_lidx_changes
-
-        # ヒットしなかった(歌詞が終了した)
-        if not self.song_finished:
+            # 歌詞が終了した(lyrincs_indexは終端の一つ前の歌詞にする)
             self.song_finished = True
+            self.lyrincs_index = len(self.score.score) - 2
             return True
 
-        return False
+        # 巻き戻った場合は曲の終了を取り消す
+        self.song_finished = False
+
+        # 歌詞が変わっているか
+        if index == self.lyrincs_index:
+            return False
+
+        self.lyrincs_index = index
+        return True
 
     def get_current_section(self):
         """
-        与えられた時間に置いて打つべき歌詞のデータを求める。
+        与えられた時間が属するセクションを求める。
 
-        :return: データ, lyrincs_indexが変化したか
+        :return: section_indexが変化したか
         """
 
         if len(self.score.section) == 0:
             self.section_finished = True
             return False
 
-        if self.section_index > len(self.score.section) - 1:
-            return False
-        else:
-            if self.score.section[self.section_index + 1][0] > self.pos:
-                return False
-
-        for i in range(self.section_index, len(self.score.section)):
-            if i < 0:
-                continue
-
-            if self.score.section[i][0] >= self.pos:
+        index = self.score.get_section_index(self.pos)
+        self.section_finished = index >= len(self.score.section) - 1
 
-                is_lidx_changes = (i - 1) != self.section_index
-                if is_lidx_changes:
-                    self.section_index = i - 1
-                return is_lidx_changes
+        if index == self.section_index:
+            return False
 
-        self.section_finished = True
-        return False
+        self.section_index = index
+        return True
 
     def update_current_zone(self):
         """
         与えられた時間が属するゾーンを求める。
+        ゾーンに属している場合はis_in_zoneがTrueになり、zone_indexにゾーン開始の番号が入る。
 
-        :return: ゾーン名。ゾーンに属していない場合はNoneを返す
+        :return: なし
         """
 
         if len(self.score.zone) == 0:
             self.is_in_zone = False
             return
 
-        if self.zone_index == len(self.score.zone) - 2:
-            if self.score.zone[self.zone_index + 1][0] > self.pos:
-                self.is_in_zone = True
-                return
-            else:
-                self.is_in_zone = False
-                return
+        index = self.score.get_zone_index(self.pos)
+
+        # 直前のゾーン情報が開始ならゾーン内にいる
+        if index >= 0 and self.score.zone[index][2] == "start":
+            self.zone_index = index
+            self.is_in_zone = True
         else:
-            if self.score.zone[self.zone_index][0] <= self.pos < self.score.zone[self.zone_index + 1][0]:
-                return
+            self.is_in_zone = False
 
-        for i in range(self.zone_index, len(self.score.zone)):
-            if i < 0:
-                continue
+    def resync_score(self):
+        """
+        譜面の表が差し替えられたあとに、現在位置の歌詞・ゾーン・セクションを求め直す。
+        今の歌詞が変わっていなければ、タイプの途中の状態はそのまま残す。
 
-            if self.score.zone[i][0] >= self.pos and self.score.zone[i][2] == "end":
-                if self.score.zone[i - 1][0] <= self.pos and self.score.zone[i - 1][2] == "start":
+        :return: なし
+        """
+        if len(self.score.score) == 0:
+            self.song_finished = True
+            return
 
-                    is_lidx_changes = (i - 1) != self.zone_index
-                    if is_lidx_changes:
-                        self.zone_index = i - 1
+        index = self.score.get_lyrics_index(self.pos)
 
-                    self.is_in_zone = True
-                    return
-                else:
-                    if self.zone_index != 0:
-                        self.zone_index = 0
-                        self.is_in_zone = False
-                        return
+        if index >= len(self.score.score) - 1:
+            # 最後の歌詞(終端)の開始時間を過ぎている
+            self.lyrincs_index = len(self.score.score) - 2
+            if not self.song_finished:
+                self.song_finished = True
+                self.update_current_lyrics("", "")
+        else:
+            self.lyrincs_index = index
+            self.song_finished = False
+
+            full, kana = self.score.score[index][1], self.score.score[index][2]
+            if full == self.full and kana == self.full_kana:
+                # 同じふりがなのオートマトンは状態の番号も同じなので、そのまま続けられる
+                self.typing = self.score.typing[index]
+                self.set_typing_state(self.typing_state)
+            else:
+                self.update_current_lyrics()
 
-                    self.is_in_zone = False
-                    return
+        # セクションは変化を起こさずに番号だけ合わせる
+        self.section_index = self.score.get_section_index(self.pos)
+        self.section_finished = len(self.score.section) == 0 or self.section_index >= len(self.score.section) - 1
 
-        self.is_in_zone = False
-        return
+        self.update_current_zone()
+
+    def seek(self, pos):
+        """
+        プレイの情報を最初の状態に戻し、指定した時間からやり直す。
+        歌詞・ゾーン・セクションは二分探索で求めるので、どの時間にも一瞬で移れる。
+
+        :param pos: やり直す時間
+        :return: なし
+        """
+        self.reset()
+        self.pos = pos
+        self.resync_score()
+        self.override_key_prev_pos(pos)
 
     # *** 残り時間情報 ***
     def get_sentence_full_time(self):
@@ -467,7 +658,33 @@ class GameInfo:
 
         :return: 成功比率（成功回数/(成功回数+失敗回数)）
         """
-        return self.calc_accuracy(self.count, self.missed)
+        return self.get_stats()["accuracy"]
+
+    def get_stats(self):
+        """
+        成功比率・達成率・ランクなどをまとめて求める。
+        成功回数・失敗回数・点数が変わっていなければ、前回の計算結果を返す。
+
+        :return: accuracy, rate, limited_rate, rank, next_rank_gapをキーとした辞書
+        """
+        key = (self.count, self.missed, self.point, self.standard_point)
+        if key == self.stats_key:
+            return self.stats
+
+        accuracy = self.calc_accuracy(self.count, self.missed)
+        rate = self.calc_rate(accuracy, False)
+        rank = get_rank_by_rate(rate)
+
+        self.stats = {
+            "accuracy": accuracy,
+            "rate": rate,
+            "limited_rate": self.calc_rate(accuracy, True),
+            "rank": rank,
+            "next_rank_gap": RANK_STANDARD[rank - 1] - rate * 100 if rank > 0 else 0
+        }
+        self.stats_key = key
+
+        return self.stats
 
     def get_sentence_accuracy(self):
         """
@@ -493,17 +710,31 @@ class GameInfo:
         if full is None:
             full = self.score.score[self.lyrincs_index][1]
 
+        # 譜面の歌詞ならコンパイル済みのオートマトンを使う
         if kana is None:
             kana = self.score.score[self.lyrincs_index][2]
+            self.typing = self.score.typing[self.lyrincs_index]
+        else:
+            self.typing = TypingAutomaton(kana)
 
         self.full = full
-        self.target_kana = kana
         self.full_kana = kana
-        self.target_roma = Romautil.hira2roma(self.target_kana)
+        self.set_typing_state(TypingAutomaton.START)
 
         if len(self.target_roma) == 0:
             self.completed = True
 
+    def set_typing_state(self, state):
+        """
+        タイプ判定の状態を設定し、残りのローマ字／ひらがなを更新する。
+
+        :param state: オートマトンの状態
+        :return: なし
+        """
+        self.typing_state = state
+        self.target_roma = self.typing.remaining_roma[state]
+        self.target_kana = self.typing.remaining_kana[state]
+
     def apply_TLE(self):
         """
         TLE計算をする
@@ -517,7 +748,9 @@ class GameInfo:
             return
 
         self.point += GameInfo.COULDNT_TYPE_POINT * len(self.target_roma)
-        self.standard_point += GameInfo.ONE_CHAR_POINT * len(self.target_roma) * 40
+        # 打てなかった分の理想の点数も、再生速度に合わせる(再生速度が1なら1文字あたりONE_CHAR_POINTの40倍)
+        self.standard_point += int(GameInfo.ONE_CHAR_POINT * len(self.target_roma) * 40
+                                   * self.get_ideal_type_speed() / GameInfo.IDEAL_TYPE_SPEED)
         self.standard_point += GameInfo.CLEAR_POINT + GameInfo.PERFECT_POINT
 
         self.missed += len(self.target_roma)
@@ -554,9 +787,12 @@ class GameInfo:
         self.section_count = 0
         self.section_miss = 0
 
-    def count_success(self):
+    def count_success(self, code=None):
         """
         タイプ成功をカウントする。
+
+        :param code: タイプされたキー。is_expected_keyで確認済みのもの。省略すると表示中のローマ字の先頭になる
+        :return: 獲得した点数
         """
 
         # スコア／理想スコアをカウントする
@@ -570,21 +806,21 @@ class GameInfo:
 
         # self.point += int(10 * self.get_key_per_second())
 
-        self.standard_point += int(GameInfo.ONE_CHAR_POINT * GameInfo.IDEAL_TYPE_SPEED * 10 * (self.combo / 10))
+        self.standard_point += int(GameInfo.ONE_CHAR_POINT * self.get_ideal_type_speed() * 10 * (self.combo / 10))
 
         # tech-zone ゾーン内にいるか
         if self.is_in_zone and self.score.zone[self.zone_index] == "tech-zone":
             self.point += self.SPECIAL_POINT
 
-        # 歌詞情報を更新する
-        self.typed_roma += self.target_roma[:1]
-        self.target_roma = self.target_roma[1:]
+        if code is None:
+            code = self.target_roma[:1]
 
-        # 打つべきかなを取得する
-        self.target_kana = Romautil.get_not_halfway_hr(self.target_kana, self.target_roma)
+        # 歌詞情報を更新する
+        self.typed_roma += code
+        self.set_typing_state(self.typing.next_state(self.typing_state, code))
 
         # ひらがな一つのタイプが終了した?
-        if not Romautil.is_halfway(self.target_kana, self.target_roma):
+        if not self.typing.halfway[self.typing_state]:
             # キータイプをカウントする
             self.keytype_tick()
 
@@ -646,31 +882,7 @@ class GameInfo:
         if len(self.target_roma) == 0:
             return False
 
-        if not Romautil.is_halfway(self.target_kana, self.target_roma):
-
-            first_syllable = Romautil.get_first_syllable(self.target_kana)
-            kunrei = romkan.to_kunrei(first_syllable)
-            hepburn = romkan.to_hepburn(first_syllable)
-            optimized = Romautil.hira2roma(first_syllable)
-
-            if kunrei[0] == "x":
-                return self.is_exactly_expected_key(code)
-            if kunrei[0] == code:
-                print("Kunrei, approve.")
-                return True
-            elif hepburn[0] == code:
-                print("Hepburn, approve.")
-                self.target_roma = hepburn + self.target_roma[len(kunrei):]
-                return True
-            elif optimized[0] == code:
-                print("Optimized, approve.")
-                self.target_roma = optimized + self.target_roma[len(kunrei):]
-                return True
-            else:
-                print("kunrei nor hepburn, deny.")
-                return False
-        else:
-            return self.is_exactly_expected_key(code)
+        return self.typing.next_state(self.typing_state, code) != -1
 
     def get_rate(self, accuracy=-1, limit=False):
         """
@@ -682,7 +894,18 @@ class GameInfo:
         """
 
         if accuracy == -1:
-            accuracy = self.get_full_accuracy()
+            return self.get_stats()["limited_rate" if limit else "rate"]
+
+        return self.calc_rate(accuracy, limit)
+
+    def calc_rate(self, accuracy, limit):
+        """
+        指定した成功比率で達成率を計算する
+
+        :param accuracy: 計算に使用する成功比率
+        :param limit: 100%を超えないようにするか
+        :return: 達成率
+        """
 
         standard = (self.standard_point + self.count * 45)
         score = self.point * accuracy
@@ -702,14 +925,18 @@ class GameInfo:
         :param accuracy: 計算に使用する達成率。
         :return: ランクのID
         """
-        rank_standard = [200, 150, 125, 100, 99.50, 99, 98, 97, 94, 90, 80, 60, 40, 20, 10, 0]
+        if accuracy == -1:
+            return self.get_stats()["rank"]
+
+        return get_rank_by_rate(self.calc_rate(accuracy, False))
 
-        rate = self.get_rate(accuracy)
+    def get_next_rank_gap(self):
+        """
+        一つ上のランクまでに必要な達成率[%]を求める。
 
-        for i in range(0, len(rank_standard)):
-            if rank_standard[i] < rate * 100:
-                return i
-        return len(rank_standard) - 1
+        :return: 必要な達成率[%]。一番上のランクの場合は0
+        """
+        return self.get_stats()["next_rank_gap"]
 
     def keytype_tick(self):
         """
@@ -724,9 +951,6 @@ class GameInfo:
         self.key_log.append(self.pos - self.prev_time)
         self.prev_time = self.pos
 
-        if len(self.key_log) > self.length:
-            del self.key_log[0]
-
     def override_key_prev_pos(self, pos=-1):
         """
         前回のキータイプ時間を指定した時間で上書きする。
@@ -741,10 +965,30 @@ class GameInfo:
         1つのキータイプに要する平均時間を求める
         :return: キータイプ時間
         """
-        if len(self.key_log) == 0:
-            return 0
+        return self.key_log.mean()
 
-        return sum(self.key_log) / len(self.key_log)
+    def get_key_type_variance(self):
+        """
+        1つのキータイプに要する時間の分散を求める
+        :return: キータイプ時間の分散
+        """
+        return self.key_log.variance()
+
+    def get_key_type_percentile(self, percent):
+        """
+        1つのキータイプに要する時間のパーセンタイルを求める。呼ぶたびに並べ替えるので重い
+        :param percent: 0～100
+        :return: キータイプ時間
+        """
+        return self.key_log.percentile(percent)
+
+    def get_ideal_type_speed(self):
+        """
+        理想のタイプ速度を求める。再生速度を変えると同じ歌詞を打つ時間も変わるので、再生速度の分だけ速くする。
+
+        :return: [key/sec]
+        """
+        return GameInfo.IDEAL_TYPE_SPEED * self.score.speed
 
     def get_key_per_second(self):
         """
@@ -752,25 +996,79 @@ class GameInfo:
 
         :return: [key/sec]
         """
-        if len(self.key_log) == 0:
+        average = self.key_log.mean()
+        if average == 0:
             return 0
 
-        return 1 / self.get_key_type_average()
+        return 1 / average
+
+
+class Session:
+    """
+    一曲分のプレイに使うものをまとめて持ち、リトライのときに使いまわす。
+    画面・キーボードの描画・譜面・ミキサーに読み込んだ曲はそのまま残し、ゲームの情報だけを最初に戻す。
+    """
+
+    def __init__(self, score, dirty_rect=False):
+        """
+        セッションを始める。曲はミキサーに読み込まれている必要がある。
+
+        :param score: 譜面データ
+        :param dirty_rect: 変化した領域だけを画面に反映するか
+        """
+        self.score = score
+        self.ui = Screen(dirty_rect=dirty_rect)
+        self.keyboard_drawer = DrawingUtil.KeyboardDrawer(self.ui.screen, 193, self.ui.full_font, 40, 5, 2)
+        self.game_info = GameInfo(score)
+
+    def reset(self):
+        """
+        プレイを始める前の状態に戻す。
+
+        :return: なし
+        """
+        with profiler.measure("session.reset"):
+            self.game_info.reset()
+            self.ui.reset()
 
 
 class SoundEffectConstants:
     """
     効果音ファイルの集合体。
+    プレイ中にはじめて鳴らすときに読み込むと処理が詰まるので、
+    ミキサーを初期化したらload()ですべて読み込んでおくこと。
     """
-    success = pygame.mixer.Sound("ses/success.wav")
-    special_success = pygame.mixer.Sound("ses/special.wav")
-    failed = pygame.mixer.Sound("ses/failed.wav")
-    unneccesary = pygame.mixer.Sound("ses/unneccesary.wav")
-    gameover = pygame.mixer.Sound("ses/gameover.wav")
-    ac = pygame.mixer.Sound("ses/ac.wav")
-    wa = pygame.mixer.Sound("ses/wa.wav")
-    fast = pygame.mixer.Sound("ses/fast.wav")
-    tle = pygame.mixer.Sound("ses/tle.wav")
+    FILES = {
+        "success": "ses/success.wav",
+        "special_success": "ses/special.wav",
+        "failed": "ses/failed.wav",
+        "unneccesary": "ses/unneccesary.wav",
+        "gameover": "ses/gameover.wav",
+        "ac": "ses/ac.wav",
+        "wa": "ses/wa.wav",
+        "fast": "ses/fast.wav",
+        "tle": "ses/tle.wav"
+    }
+
+    success = None
+    special_success = None
+    failed = None
+    unneccesary = None
+    gameover = None
+    ac = None
+    wa = None
+    fast = None
+    tle = None
+
+    @staticmethod
+    def load():
+        """
+        すべての効果音を読み込む。ミキサーは初期化されている必要がある。
+
+        :return: なし
+        """
+        for name, file_name in SoundEffectConstants.FILES.items():
+            setattr(SoundEffectConstants, name, registry.get_sound(file_name))
 
 
 class Score:
@@ -787,26 +1085,49 @@ class Score:
         self.zone = []
         self.section = []
 
-    def log_error(self, line, text, init=True):
+        # 譜面ファイルのSHA-1(リプレイと譜面を結びつけるのに使う)
+        self.file_hash = b""
+
+        # 再生速度と、速度を変えた曲のファイル(Noneなら元の曲)
+        self.speed = 1.0
+        self.music_file = None
+
+        # 歌詞ごとのタイプ判定用オートマトン
+        self.typing = []
+
+        # パースし直すための、ファイルのエンコード／行／パース結果のイベント／各行の頭でのパーサーの状態
+        self.encoding = None
+        self.source_lines = []
+        self.events = []
+        self.line_states = []
+
+        # 二分探索用の時間インデックス
+        self.score_time = []
+        self.zone_time = []
+        self.section_time = []
+
+    def log_error(self, line, text, column=0, init=False):
         """
-        エラーログを記録し、データを削除する。
+        エラーログを記録する。
         :param line: ログを出力するときの行。
         :param text: ログ内容。
-        :param init: データを削除するか(デフォルト: True)
+        :param column: ログを出力するときの列(1始まり、不明なら0)。
+        :param init: データを削除するか(デフォルト: False)
         :return: なし
         """
-        self.log.append([Score.LOG_ERROR, line, text])
+        self.log.append([Score.LOG_ERROR, line, text, column])
         if init:
             self.re_initialize_except_log()
 
-    def log_warn(self, line, text):
+    def log_warn(self, line, text, column=0):
         """
         警告ログを記録する。
         :param line: ログを出力するときの行。
         :param text: ログ内容。
+        :param column: ログを出力するときの列(1始まり、不明なら0)。
         :return: なし
         """
-        self.log.append([Score.LOG_WARN, line, text])
+        self.log.append([Score.LOG_WARN, line, text, column])
 
     def re_initialize_except_log(self):
         """
@@ -817,171 +1138,324 @@ class Score:
         self.score = []
         self.zone = []
         self.section = []
+        self.typing = []
+        self.build_index()
 
-    def read_score(self, file_name):
+    def build_index(self):
+        """
+        歌詞／ゾーン／セクションの開始時間のインデックスを作成する。
+        各データは時間順に並んでいる必要がある。
+
+        :return: なし
+        """
+        self.score_time = [x[0] for x in self.score]
+        self.zone_time = [x[0] for x in self.zone]
+        self.section_time = [x[0] for x in self.section]
+
+    def compile_typing(self, reuse=None):
+        """
+        歌詞ごとにタイプ判定用オートマトンを作成する。
+
+        :param reuse: ふりがなとオートマトンの辞書。ふりがなが同じならこれを使いまわす
+        :return: なし
+        """
+        if reuse is None:
+            reuse = {}
+
+        self.typing = [reuse.get(x[2]) or TypingAutomaton(x[2]) for x in self.score]
+
+    def get_lyrics_index(self, pos):
+        """
+        指定した時間に表示されている歌詞の番号を求める。
+
+        :param pos: 時間
+        :return: 歌詞の番号。どの歌詞よりも前の場合は-1
+        """
+        return bisect_right(self.score_time, pos) - 1
+
+    def get_section_index(self, pos):
+        """
+        指定した時間が属するセクションの番号を求める。
+
+        :param pos: 時間
+        :return: セクションの番号。どのセクションよりも前の場合は-1
+        """
+        return bisect_right(self.section_time, pos) - 1
+
+    def get_zone_index(self, pos):
+        """
+        指定した時間の直前にあるゾーン情報(開始／終了)の番号を求める。
+
+        :param pos: 時間
+        :return: ゾーン情報の番号。どのゾーン情報よりも前の場合は-1
+        """
+        return bisect_right(self.zone_time, pos) - 1
+
+    def set_speed(self, speed, music_file=None):
+        """
+        再生速度を変える。歌詞／セクション／ゾーンの時間を速度に合わせて縮め(伸ばし)、インデックスを作り直す。
+
+        :param speed: 再生速度(1で元の速さ)
+        :param music_file: 速度を変えた曲のファイル。省略すると元の曲を使う
+        :return: なし
+        """
+        self.scale_times(self.speed / speed)
+        self.speed = speed
+        self.music_file = music_file
+        self.build_index()
+
+    def scale_times(self, ratio):
+        """
+        歌詞／セクション／ゾーンの時間をratio倍する。インデックスは作り直さない。
+
+        :param ratio: 倍率
+        :return: なし
+        """
+        for table in (self.score, self.zone, self.section):
+            for row in table:
+                row[0] *= ratio
+
+    def get_section_range(self, index):
+        """
+        セクションの開始時間と終了時間(次のセクションの開始時間)を求める。
+        最後のセクションは、最後の歌詞(終端)の時間で終わる。
+
+        :param index: セクションの番号
+        :return: (開始時間, 終了時間)
+        """
+        start = self.section[index][0]
+        if index + 1 < len(self.section):
+            end = self.section[index + 1][0]
+        else:
+            end = self.score_time[-1]
+
+        return start, end
+
+    def read_score(self, file_name, use_cache=True, load_music=True):
         """
         ファイルから譜面データを読み込み、このインスタンスに値をセットする。
+        譜面が変更されていなければ、コンパイル済みのキャッシュから読み込む。
+
         :param file_name: 譜面データの入ったファイル
+        :param use_cache: キャッシュを使用するか(デフォルト: True)
+        :param load_music: 曲をミキサーに読み込むか(デフォルト: True)
         :return: なし(このメソッドは破壊性である)
         """
 
-        # ----- [ 下準備 ] -----
+        # 譜面のハッシュは、キャッシュのヘッダと更新時刻が合わないときだけ求める
+        cache_loaded = False
+        file_hash = None
+        if use_cache:
+            with profiler.measure("score.cache_load"):
+                cache_loaded, file_hash = ScoreCache.load(self, file_name)
 
-        # 便利なやつ
-        re_rect_bracket = re.compile(r"\[(.*)\]")
+        if file_hash is None:
+            with profiler.measure("score.hash"):
+                file_hash = ScoreCache.get_file_hash(file_name)
+        self.file_hash = file_hash
 
-        # エンコードを判別する
-        with open(file_name, mode="rb") as f:
-            detect_result = chardet.detect(f.read())
+        if not cache_loaded:
+            # score.parse_totalにはscore.chardetの時間も含まれる
+            with profiler.measure("score.parse_total"):
+                self.parse_score(file_name)
 
-        encoding = detect_result["encoding"]
+            # エラーがなければキャッシュしておく
+            if use_cache and not self.has_error:
+                with profiler.measure("score.cache_save"):
+                    ScoreCache.save(self, file_name, file_hash)
 
-        # ファイルを読み込む
-        with open(file_name, mode="r", encoding=encoding) as f:
-            lines = f.readlines()
+        # エラーは出ていないか(曲が指定されていない場合もエラーとして記録されている)
+        if not self.has_error:
+            if load_music:
+                # 読み込む
+                self.load_music()
+        else:
+            # エラーなので、最初のエラーを例外としてスローする(すべてのエラーはlogに残っている)
+            first_error = next(x for x in self.log if x[0] == Score.LOG_ERROR)
+            raise ScoreFormatError(first_error[1], first_error[2])
 
-        # ----- [ パース ] -----
+    def load_music(self):
+        """
+        曲をミキサーに読み込む。メインスレッドから呼ぶ必要がある。
 
-        current_minute = 0
-        current_time = 0
+        :return: なし
+        """
+        with profiler.measure("score.music_load"):
+            pygame.mixer.music.load(self.music_file or self.properties["song_data"])
 
-        song = ""
-        phon = ""
+    @property
+    def offset(self):
+        """
+        譜面のオフセット。曲のこの位置[秒]が譜面の0秒になる。
+        再生速度を変えている場合は、速度を変えた曲での位置になる。
+
+        :return: オフセット[秒]。指定されていないか、数値でない場合は0
+        """
+        try:
+            return float(self.properties.get("offset", 0)) / self.speed
+        except ValueError:
+            return 0.0
 
-        is_in_song = False
+    @property
+    def has_error(self):
+        """
+        エラーログが記録されているか。
+
+        :return: エラーが記録されている場合はTrue
+        """
+        return any(x[0] == Score.LOG_ERROR for x in self.log)
 
-        for i in range(len(lines)):
+    def parse_score(self, file_name):
+        """
+        ファイルをパースして、このインスタンスに値をセットする。
+        エラーは例外ではなくログに記録され、エラーがあっても最後までパースする。
 
-            line = lines[i].strip()
+        :param file_name: 譜面データの入ったファイル
+        :return: なし(このメソッドは破壊性である)
+        """
 
-            # ----- 処理対象行かの確認
+        # エンコードを判別する
+        with profiler.measure("score.chardet"):
+            self.encoding = ScoreParser.detect_encoding(file_name)
 
-            # コメント
-            if line.startswith("#"):
-                continue
+        # 一行ずつ読みながらパースする(パースし直せるように、行は取っておく)
+        self.source_lines = []
+        self.line_states = []
 
-            # 空行
-            if len(line) == 0:
-                continue
+        def remember(lines):
+            for line in lines:
+                self.source_lines.append(line)
+                yield line
 
-            # カギカッコ
-            rect_blk_match = re_rect_bracket.match(line)
+        self.events = list(ScoreParser.parse_lines(
+            remember(ScoreParser.read_lines(file_name, self.encoding)), states=self.line_states
+        ))
 
-            # ----- 曲外での処理
+        self.apply_events(self.events)
 
-            if not is_in_song:
+    def reparse_score(self, file_name):
+        """
+        ファイルの変更された行から後ろだけをパースし直して、このインスタンスに値をセットする。
+        前にパースしていない(キャッシュから読み込んだなど)場合は全体をパースする。
 
-                # 曲に関するプロパティ
-                if line.startswith(":") and not is_in_song:
-                    line = line[1:]
-                    key, value = line.split()
-                    set_val_to_dictionary(self.properties, key, value)
-                    continue
+        :param file_name: 譜面データの入ったファイル
+        :return: 最初に変更された行の番号(1始まり)。変更がなければ-1
+        """
+        self.file_hash = ScoreCache.get_file_hash(file_name)
 
-                if rect_blk_match is not None:
-                    command = rect_blk_match[1]
+        if len(self.line_states) == 0:
+            self.parse_score(file_name)
+            return 1
 
-                    # 曲開始コマンド?
-                    if command == "start":
-                        is_in_song = True
-                        continue
+        lines = list(ScoreParser.read_lines(file_name, self.encoding))
 
-                # 上記の条件にヒットしない文字列は、
-                # 曲データの外では許可されない
-                self.log_error(i + 1, "Unknown text outside song section")
-                self.re_initialize_except_log()
+        # 最初に変更された行を探す
+        first = 0
+        for old_line, new_line in zip(self.source_lines, lines):
+            if old_line != new_line:
                 break
+            first += 1
 
-            # ----- 曲外での処理
+        if first == len(lines) == len(self.source_lines):
+            return -1
 
-            # カギカッコで囲まれているか
-            if rect_blk_match is not None:
-                command = rect_blk_match[1]
-                # 間奏などで歌詞データがない
-                if command == "break":
-                    self.score.append([current_time, "", ""])
-                    continue
-                if command == "end":
-                    self.score.append([current_time, ">>end<<", ""])
-                    is_in_song = False
-                    continue
+        # 変更された行より前のイベントはそのまま使う
+        states = self.line_states[:first]
+        events = [x for x in self.events if x.line <= first]
+        events += ScoreParser.parse_lines(lines[first:], self.line_states[first], first + 1, states)
 
-            # 歌詞のみ(キャプションなど)
-            if line.startswith(">>"):
-                self.score.append([current_time, line[2:], ""])
-                continue
-
-            # 分指定演算子
-            if line.startswith("|"):
-                line = line[1:]
-                current_minute = int(line)
-                continue
-
-            # 秒指定演算子
-            # 秒指定演算子で、現在時間の更新と一緒に歌詞データの書き込みも実施する
-            if line.startswith("*"):
-                line = line[1:]
-
-                # 歌詞データが提供されているのにも関わらず、ふりがなデータがない
-                if len(song) != 0:
-                    if len(phon) == 0:
-                        # これはダメで、エラーを吐く
-                        self.log_error(i + 1, "No pronunciation data")
-                        break
-                    else:
-                        self.score.append([current_time, song, phon])
+        self.source_lines = lines
+        self.line_states = states
+        self.events = events
+
+        self.apply_events(events)
+
+        return first + 1
+
+    def apply_events(self, events):
+        """
+        パーサーのイベントから譜面データとログを作り直す。
+
+        :param events: ScoreEventのリスト
+        :return: なし(このメソッドは破壊性である)
+        """
+
+        # ふりがなが変わっていない歌詞のオートマトンは使いまわす
+        old_typing = {x.kana: x for x in self.typing}
+
+        self.log = []
+        self.properties = {}
+        self.score = []
+        self.zone = []
+        self.section = []
+
+        current_time = 0
+
+        # 書き込み待ちの歌詞とふりがな
+        song = ""
+        phon = ""
+
+        # ふりがなのない歌詞や戻る時間などは、validate_eventsがエラーのイベントにしてくれる
+        for event in ScoreParser.validate_events(events):
+            kind = event.kind
+
+            # 曲に関するプロパティ
+            if kind == ScoreParser.EVENT_PROPERTY:
+                set_val_to_dictionary(self.properties, *event.value)
+
+            # 時間の更新と一緒に歌詞データの書き込みも実施する
+            elif kind == ScoreParser.EVENT_TIME:
+                # ふりがながない歌詞はエラーになっているので、書き込まない
+                if len(song) != 0 and len(phon) != 0:
+                    self.score.append([current_time, song, phon])
 
                 # リセットする
                 song = ""
                 phon = ""
 
-                # 現在時間をセットする
-                current_time = 60 * current_minute + float(line)
-                continue
-
-            # セクション演算子
-            if line.startswith("@"):
-                line = line[1:]
-                self.section.append([current_time, line])
-                continue
-
-            # ゾーン演算子
-            if line.startswith("!"):
-                line = line[1:]
-                flag, zone_name = line.split()
-
-                # ゾーンが始まる
-                if flag == "start":
-                    self.zone.append([current_time, zone_name, "start"])
-                    continue
-                # ゾーンが終わる
-                elif flag == "end":
-                    self.zone.append([current_time, zone_name, "end"])
-                    continue
-
-            # ふりがなデータ
-            if line.startswith(":"):
-                phon += line[1:]
-                continue
-
-            # 特に何もなければそれは歌詞
-            song += line
+                current_time = event.value
+
+            elif kind == ScoreParser.EVENT_LYRIC:
+                song += event.value
+
+            elif kind == ScoreParser.EVENT_KANA:
+                phon += event.value
+
+            # 歌詞のみ(キャプションなど)
+            elif kind == ScoreParser.EVENT_CAPTION:
+                self.score.append([current_time, event.value, ""])
+
+            # 間奏などで歌詞データがない
+            elif kind == ScoreParser.EVENT_BREAK:
+                self.score.append([current_time, "", ""])
+
+            elif kind == ScoreParser.EVENT_END:
+                self.score.append([current_time, ">>end<<", ""])
+
+            elif kind == ScoreParser.EVENT_SECTION:
+                self.section.append([current_time, event.value])
+
+            elif kind == ScoreParser.EVENT_ZONE:
+                self.zone.append([current_time, event.value[0], event.value[1]])
+
+            elif kind == ScoreParser.EVENT_ERROR:
+                self.log_error(event.line, event.value, event.column)
+
+            elif kind == ScoreParser.EVENT_WARNING:
+                self.log_warn(event.line, event.value, event.column)
+
+        # ログは行の順に並べる
+        self.log.sort(key=lambda x: (x[1], x[3]))
 
         # 読み込み終わり
         self.score.insert(0, [0, "", ""])
 
-        # エラーは出ていないか
-        if len(list(filter(lambda x: x[0] == Score.LOG_ERROR, self.log))) == 0:
-            # wavは定義されているか
-            if "song_data" not in self.properties.keys():
-                # それはダメ
-                raise ScoreFormatError(0, "Song is not specified")
-            else:
-                # 読み込む
-                pygame.mixer.music.load(self.properties["song_data"])
-        else:
-            # エラーなので例外をスローする
-            raise ScoreFormatError(self.log[0][1], self.log[0][2])
+        # 再生速度を変えている場合は、パースし直した時間も合わせる
+        if self.speed != 1:
+            self.scale_times(1 / self.speed)
+
+        self.build_index()
+        self.compile_typing(old_typing)
 
 
 def set_val_to_dictionary(dictionary, key, value):
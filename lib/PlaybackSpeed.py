@@ -0,0 +1,157 @@
+##############################
+#                            #
+#   loxygenK/musical_typer   #
+#   再生速度の変更           #
+#   (c)2020 loxygenK         #
+#      All rights reversed.   #
+#                            #
+##############################
+
+import hashlib
+import os
+import wave
+
+# 速度を変えた曲を保存するディレクトリ
+SPEED_CACHE_DIR = "speed_cache"
+
+# 指定できる再生速度の範囲
+MIN_SPEED = 0.5
+MAX_SPEED = 1.5
+
+# 一度に変換するフレーム数(メモリを使いすぎないように分けて変換する)
+CHUNK_FRAMES = 1 << 18
+
+# サンプルの大きさ[バイト]とNumPyの型(WAVはリトルエンディアン)
+SAMPLE_TYPES = {1: "u1", 2: "<i2", 4: "<i4"}
+
+
+class SpeedChangeError(Exception):
+    """
+    曲の速度を変えられなかった(WAVでない・読めない・保存できないなど)。
+    """
+    pass
+
+
+def get_cache_path(file_name, speed):
+    """
+    速度を変えた曲を保存するファイルのパスを取得する。
+    曲のファイルが変更されたら別のパスになる。
+
+    :param file_name: 曲のファイル
+    :param speed: 再生速度
+    :return: 保存するファイルのパス
+    """
+    stat = os.stat(file_name)
+    key = "{}|{}|{}".format(os.path.abspath(file_name), stat.st_mtime_ns, stat.st_size)
+    return os.path.join(SPEED_CACHE_DIR, "{}_{:.3f}.wav".format(hashlib.sha1(key.encode("utf-8")).hexdigest(), speed))
+
+
+def resample(samples, speed, start, stop):
+    """
+    サンプルを線形補間で間引き／水増しして、速度を変えたときのstart～stopフレーム目を求める。
+    音程も速度に合わせて変わる(テープの早回しと同じ)。
+    曲全体をfloatにするとメモリを使いすぎるので、必要な範囲だけをfloatにして計算する。
+
+    :param samples: (フレーム数, チャンネル数)のNumPy配列(整数のままでよい)
+    :param speed: 再生速度
+    :param start: 求める最初のフレーム
+    :param stop: 求める最後のフレームの次
+    :return: (stop - start, チャンネル数)のfloat64の配列
+    """
+    import numpy
+
+    if start >= stop:
+        return numpy.zeros((0, samples.shape[1]))
+
+    positions = numpy.arange(start, stop) * speed
+    index = positions.astype(numpy.int64)
+    ratio = (positions - index)[:, None]
+
+    # 元の曲のうち、補間に使う範囲(最後のフレームの次のフレームまで)
+    first = int(index[0])
+    last = min(int(index[-1]) + 2, len(samples))
+    window = samples[first:last].astype(numpy.float64)
+
+    index -= first
+    following = numpy.minimum(index + 1, len(window) - 1)
+
+    return window[index] * (1 - ratio) + window[following] * ratio
+
+
+def get_speed_music(file_name, speed, progress=None):
+    """
+    速度を変えた曲のファイルを取得する。まだ変換していなければ変換して保存する。
+    WAVのみ対応。
+
+    :param file_name: 曲のファイル
+    :param speed: 再生速度
+    :param progress: 指定すると、変換の進み具合(0～1)を渡して呼ばれる
+    :return: 速度を変えた曲のファイル。速度が1の場合は元のファイル
+    :raises SpeedChangeError: 速度を変えられなかった場合
+    """
+    if speed == 1:
+        return file_name
+
+    try:
+        cache_path = get_cache_path(file_name, speed)
+        if not os.path.isfile(cache_path):
+            convert(file_name, cache_path, speed, progress)
+    except (wave.Error, EOFError, ValueError, OSError) as e:
+        raise SpeedChangeError(e) from e
+
+    return cache_path
+
+
+def convert(file_name, cache_path, speed, progress=None):
+    """
+    曲の速度を変えて保存する。
+
+    :param file_name: 曲のファイル
+    :param cache_path: 保存するファイル
+    :param speed: 再生速度
+    :param progress: 指定すると、変換の進み具合(0～1)を渡して呼ばれる
+    :return: なし
+    """
+    import numpy
+
+    with wave.open(file_name, "rb") as source:
+        channels = source.getnchannels()
+        sample_width = source.getsampwidth()
+        frame_rate = source.getframerate()
+        data = source.readframes(source.getnframes())
+
+    if sample_width not in SAMPLE_TYPES:
+        raise ValueError("Unsupported sample width: {} bytes".format(sample_width))
+
+    sample_type = numpy.dtype(SAMPLE_TYPES[sample_width])
+    limits = numpy.iinfo(sample_type)
+    samples = numpy.frombuffer(data, dtype=sample_type).reshape(-1, channels)
+
+    length = int(len(samples) / speed)
+
+    os.makedirs(SPEED_CACHE_DIR, exist_ok=True)
+
+    # 変換途中のファイルを読まないように、別名で書いてから置き換える
+    temp_path = cache_path + ".tmp"
+    try:
+        with wave.open(temp_path, "wb") as target:
+            target.setnchannels(channels)
+            target.setsampwidth(sample_width)
+            target.setframerate(frame_rate)
+
+            for start in range(0, length, CHUNK_FRAMES):
+                stop = min(start + CHUNK_FRAMES, length)
+                chunk = numpy.clip(numpy.rint(resample(samples, speed, start, stop)), limits.min, limits.max)
+                target.writeframes(chunk.astype(sample_type).tobytes())
+
+                if progress is not None:
+                    progress(stop / length)
+
+        os.replace(temp_path, cache_path)
+    except BaseException:
+        # 書きかけのファイルを残さない
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
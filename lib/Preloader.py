@@ -0,0 +1,105 @@
+##############################
+#                            #
+#   loxygenK/musical_typer   #
+#   譜面と曲の先読み         #
+#   (c)2020 loxygenK         #
+#      All rights reversed.   #
+#                            #
+##############################
+
+import os
+import threading
+
+from lib import PlaybackSpeed
+from lib.GameSystem import Score
+
+# 曲のファイルを一度に読む大きさ
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+class Preloader:
+    """
+    別スレッドで譜面をパースし、曲のファイルを読んでOSのキャッシュに載せておく。
+    再生速度を変える場合は、速度を変えた曲もここで作る。
+    ミキサーへの読み込みはメインスレッドで行う必要があるので、ここではしない。
+    """
+
+    def __init__(self, file_name, speed=1.0):
+        """
+        先読みを始める。
+
+        :param file_name: 譜面ファイル
+        :param speed: 再生速度
+        """
+        self.file_name = file_name
+        self.speed = speed
+        self.score = Score()
+
+        # 進み具合(0～1)と、先読み中に起きた例外
+        self.progress = 0.0
+        self.error = None
+
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        try:
+            self.score.read_score(self.file_name, load_music=False)
+            self.progress = 0.5
+
+            if self.speed != 1:
+                # 書き出したばかりのファイルはOSのキャッシュに載っているので、読み直さなくてよい
+                music_file = PlaybackSpeed.get_speed_music(self.score.properties["song_data"], self.speed,
+                                                           self._set_convert_progress)
+                self.score.set_speed(self.speed, music_file)
+            else:
+                self._warm_music(self.score.properties["song_data"])
+
+            self.progress = 1.0
+        except Exception as e:
+            # 例外はメインスレッドでwait()したときに投げ直す
+            self.error = e
+        finally:
+            self.done.set()
+
+    def _set_convert_progress(self, ratio):
+        self.progress = 0.5 + 0.5 * ratio
+
+    def _warm_music(self, file_name):
+        """
+        曲のファイルを最後まで読み、OSのキャッシュに載せる。読めなくても何もしない。
+
+        :param file_name: 曲のファイル
+        :return: なし
+        """
+        try:
+            size = max(os.path.getsize(file_name), 1)
+            with open(file_name, mode="rb") as f:
+                read = 0
+                for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), b""):
+                    read += len(chunk)
+                    self.progress = 0.5 + 0.5 * read / size
+        except OSError:
+            pass
+
+    def is_done(self):
+        """
+        先読みが終わったか。
+
+        :return: 終わっていればTrue
+        """
+        return self.done.is_set()
+
+    def wait(self):
+        """
+        先読みが終わるまで待ち、読み込んだ譜面を取得する。
+
+        :return: 読み込んだScore(ミキサーにはまだ読み込まれていない)
+        """
+        self.done.wait()
+
+        if self.error is not None:
+            raise self.error
+
+        return self.score
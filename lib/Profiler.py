@@ -0,0 +1,212 @@
+##############################
+#                            #
+#   loxygenK/musical_typer   #
+#   処理時間の計測           #
+#   (c)2020 loxygenK         #
+#      All rights reversed.   #
+#                            #
+##############################
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+from lib.RingBuffer import get_percentile
+
+# フレーム時間が目標の何倍を超えたらフレーム落ちとみなすか
+DROP_FACTOR = 1.5
+
+
+def summarize(values):
+    """
+    時間のリストを集計する。
+
+    :param values: 時間[秒]のリスト
+    :return: 平均・p50・p95・p99・最大[ミリ秒]の辞書
+    """
+    ordered = sorted(values)
+    return {
+        "mean": round(sum(ordered) / len(ordered) * 1000, 3) if ordered else 0,
+        "p50": round(get_percentile(ordered, 50) * 1000, 3),
+        "p95": round(get_percentile(ordered, 95) * 1000, 3),
+        "p99": round(get_percentile(ordered, 99) * 1000, 3),
+        "max": round(ordered[-1] * 1000, 3) if ordered else 0
+    }
+
+
+class Profiler:
+    """
+    起動時の処理とメインループの各段階にかかった時間を記録する。
+    起動時の処理は常に記録する(数回しか呼ばれないので軽い)が、
+    フレームごとの記録はenable()するまで何もしない。
+
+    段階の時間は描画するフレームごとにまとめる。フレームの間に何回もロジックを進めた場合は、
+    その合計をそのフレームの時間にするので、どの段階もi番目はframe_timesのi番目と同じフレームになる。
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.target_fps = 60
+
+        # 起動時の処理の名前と、かかった時間の合計
+        # (先読みなど、メインスレッド以外の処理は別に記録する)
+        self.timers = {}
+        self.background_timers = {}
+        self.timer_lock = threading.Lock()
+
+        # フレームの間隔と、段階ごとの時間
+        self.frame_times = []
+        self.stages = {}
+
+        # 今のフレームで記録した、段階ごとの時間の合計
+        self.pending = {}
+
+        self.frame_start = None
+        self.lap_start = 0
+
+    def enable(self, target_fps=60):
+        """
+        フレームごとの記録を有効にする。
+
+        :param target_fps: 目標のFPS。フレーム落ちの判定に使う
+        :return: なし
+        """
+        self.enabled = True
+        self.target_fps = target_fps
+
+    def add(self, name, elapsed):
+        """
+        処理にかかった時間を記録する。同じ名前の時間は足し合わされる。
+        メインスレッド以外から呼ばれた場合は、起動時の時間とは別に記録する。
+
+        :param name: 処理の名前
+        :param elapsed: かかった時間[秒]
+        :return: なし
+        """
+        if threading.current_thread() is threading.main_thread():
+            timers = self.timers
+        else:
+            timers = self.background_timers
+
+        with self.timer_lock:
+            timers[name] = timers.get(name, 0) + elapsed
+
+    @contextmanager
+    def measure(self, name):
+        """
+        withの中の処理にかかった時間を記録する。
+
+        :param name: 処理の名前
+        :return: なし
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def begin_step(self):
+        """
+        ループの一周を開始する。描画しない周でも、lap()はここからの時間を記録する。
+
+        :return: なし
+        """
+        if not self.enabled:
+            return
+
+        self.lap_start = time.perf_counter()
+
+    def begin_frame(self):
+        """
+        描画するフレームを開始する。前のフレームの開始からの時間をフレーム時間として記録し、
+        その間にlap()で記録した時間を、そのフレームの段階ごとの時間として確定する。
+        ループの最初のフレームより前の時間は捨てる。
+
+        :return: なし
+        """
+        if not self.enabled:
+            return
+
+        now = time.perf_counter()
+        if self.frame_start is not None:
+            self.frame_times.append(now - self.frame_start)
+
+            # 初めて出てきた段階は、それまでのフレームでは0だったことにする
+            for stage in self.pending:
+                if stage not in self.stages:
+                    self.stages[stage] = [0.0] * (len(self.frame_times) - 1)
+
+            for stage, values in self.stages.items():
+                values.append(self.pending.get(stage, 0.0))
+
+        self.pending = {}
+        self.frame_start = now
+        self.lap_start = now
+
+    def lap(self, stage):
+        """
+        前のlap()(またはbegin_step()、begin_frame())からの時間を、今のフレームの段階の時間に足す。
+
+        :param stage: 段階の名前
+        :return: なし
+        """
+        if not self.enabled:
+            return
+
+        now = time.perf_counter()
+        self.pending[stage] = self.pending.get(stage, 0.0) + now - self.lap_start
+        self.lap_start = now
+
+    def end_loop(self):
+        """
+        ループが終わったことを知らせる。次のループの最初のフレームは前のフレームとつなげない。
+        最後のフレームは終わっていないので、その段階の時間は捨てる。
+
+        :return: なし
+        """
+        self.frame_start = None
+        self.pending = {}
+
+    def get_dropped_frames(self):
+        """
+        フレーム落ちした回数を数える。
+
+        :return: フレーム時間が目標のDROP_FACTOR倍を超えた回数
+        """
+        limit = DROP_FACTOR / self.target_fps
+        return sum(1 for x in self.frame_times if x > limit)
+
+    def get_report(self):
+        """
+        計測結果をまとめる。
+
+        :return: 結果の辞書。時間はすべてミリ秒
+        """
+        return {
+            "startup": {name: round(elapsed * 1000, 3) for name, elapsed in self.timers.items()},
+            "background": {name: round(elapsed * 1000, 3) for name, elapsed in self.background_timers.items()},
+            "target_fps": self.target_fps,
+            "frames": len(self.frame_times),
+            "dropped_frames": self.get_dropped_frames(),
+            "frame_time": summarize(self.frame_times),
+            "stages": {stage: summarize(values) for stage, values in self.stages.items()},
+            "per_frame": dict(
+                [("frame_time", [round(x * 1000, 3) for x in self.frame_times])] +
+                [(stage, [round(x * 1000, 3) for x in values]) for stage, values in self.stages.items()]
+            )
+        }
+
+    def dump(self, file_name):
+        """
+        計測結果をJSONで書き出す。
+
+        :param file_name: 書き出すファイル
+        :return: なし
+        """
+        with open(file_name, mode="w", encoding="utf-8") as f:
+            json.dump(self.get_report(), f, ensure_ascii=False, indent=2)
+
+
+# ゲーム全体で共有するプロファイラ
+profiler = Profiler()
@@ -0,0 +1,139 @@
+##############################
+#                            #
+#   loxygenK/musical_typer   #
+#   リプレイ                 #
+#   (c)2020 loxygenK         #
+#      All rights reversed.   #
+#                            #
+##############################
+
+import os
+import struct
+import time
+
+# リプレイを保存するディレクトリ
+REPLAY_DIR = "replays"
+
+# 形式を変えたら上げる
+REPLAY_VERSION = 1
+
+# ヘッダ: マジックナンバー, バージョン, 譜面のSHA-1, 終了時間, キーの数
+HEADER = struct.Struct("<4sI20sdI")
+MAGIC = b"MTRP"
+
+# キー一つ分: 曲上の時間, キー
+KEY_ENTRY = struct.Struct("<dc")
+
+
+class ReplayFormatError(Exception):
+
+    def __init__(self, file_name, text):
+        super(ReplayFormatError, self).__init__(text + " in " + file_name + ".")
+
+    pass
+
+
+class Replay:
+    """
+    一回のプレイの記録。譜面のハッシュと、押されたキーとその時間を持つ。
+    """
+
+    def __init__(self, score_hash=b"", keys=None, end_time=0.0):
+        """
+        リプレイを初期化する。
+
+        :param score_hash: 譜面ファイルのSHA-1(20バイト)
+        :param keys: (曲上の時間, キー) のリスト
+        :param end_time: プレイが終わった時間
+        """
+        self.score_hash = score_hash
+        self.keys = keys if keys is not None else []
+        self.end_time = end_time
+
+    def add_key(self, pos, key):
+        """
+        押されたキーを記録する。
+
+        :param pos: 曲上の時間
+        :param key: キー(一文字)
+        :return: なし
+        """
+        self.keys.append((pos, key))
+
+    def to_bytes(self):
+        """
+        リプレイをバイト列にする。
+
+        :return: バイト列
+        """
+        data = bytearray(HEADER.pack(MAGIC, REPLAY_VERSION, self.score_hash, self.end_time, len(self.keys)))
+        for pos, key in self.keys:
+            data += KEY_ENTRY.pack(pos, key.encode("ascii"))
+
+        return bytes(data)
+
+    @staticmethod
+    def from_bytes(data, file_name="<bytes>"):
+        """
+        バイト列からリプレイを読み込む。
+
+        :param data: バイト列
+        :param file_name: エラーメッセージに使うファイル名
+        :return: リプレイ
+        """
+        if len(data) < HEADER.size:
+            raise ReplayFormatError(file_name, "Replay is too short")
+
+        magic, version, score_hash, end_time, count = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ReplayFormatError(file_name, "Not a replay")
+        if version != REPLAY_VERSION:
+            raise ReplayFormatError(file_name, "Unsupported replay version " + str(version))
+        if len(data) != HEADER.size + KEY_ENTRY.size * count:
+            raise ReplayFormatError(file_name, "Replay is broken")
+
+        keys = [(pos, key.decode("ascii")) for pos, key in KEY_ENTRY.iter_unpack(data[HEADER.size:])]
+
+        return Replay(score_hash, keys, end_time)
+
+    def save(self, file_name=None):
+        """
+        リプレイをファイルに保存する。保存に失敗した場合は何もしない。
+
+        :param file_name: 保存先。省略するとREPLAY_DIRに日時と譜面のハッシュから名前を付けて保存する
+                          (同じ名前のファイルがあれば、後ろに番号を付けて上書きしないようにする)
+        :return: 保存先。保存できなかった場合はNone
+        """
+        try:
+            if file_name is not None:
+                with open(file_name, mode="wb") as f:
+                    f.write(self.to_bytes())
+                return file_name
+
+            os.makedirs(REPLAY_DIR, exist_ok=True)
+            base_name = os.path.join(
+                REPLAY_DIR, "{}_{}".format(time.strftime("%Y%m%d-%H%M%S"), self.score_hash.hex()[:8])
+            )
+
+            number = 0
+            while True:
+                file_name = base_name + (".mtr" if number == 0 else "_{}.mtr".format(number))
+                try:
+                    with open(file_name, mode="xb") as f:
+                        f.write(self.to_bytes())
+                    return file_name
+                except FileExistsError:
+                    number += 1
+        except OSError:
+            return None
+
+    @staticmethod
+    def load(file_name):
+        """
+        ファイルからリプレイを読み込む。
+
+        :param file_name: リプレイファイル
+        :return: リプレイ
+        """
+        with open(file_name, mode="rb") as f:
+            return Replay.from_bytes(f.read(), file_name)
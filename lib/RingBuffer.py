@@ -0,0 +1,145 @@
+##############################
+#                            #
+#   loxygenK/musical_typer   #
+#   リングバッファ           #
+#   (c)2020 loxygenK         #
+#      All rights reversed.   #
+#                            #
+##############################
+
+import math
+
+
+def get_percentile(ordered, percent):
+    """
+    昇順に並べた値からパーセンタイルを求める。
+
+    :param ordered: 昇順に並べた値
+    :param percent: 0～100
+    :return: パーセンタイル(線形補間)。値がない場合は0
+    """
+    if len(ordered) == 0:
+        return 0
+
+    position = (len(ordered) - 1) * percent / 100
+    lower = math.floor(position)
+    upper = min(lower + 1, len(ordered) - 1)
+
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+class RingBuffer:
+    """
+    容量が固定された数値のリングバッファ。
+    合計と二乗の合計を持ち続けるので、平均と分散はO(1)で求められる。
+    """
+
+    def __init__(self, capacity):
+        """
+        リングバッファを初期化する。
+
+        :param capacity: 容量。これを超えると古いものから捨てる
+        """
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+
+        self.capacity = capacity
+        self.values = [0.0] * capacity
+        self.start = 0
+        self.length = 0
+
+        # 合計／二乗の合計
+        self.total = 0.0
+        self.square_total = 0.0
+
+        # 浮動小数点の誤差がたまらないように、ときどき合計を計算し直す
+        self.appended_since_resum = 0
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        for i in range(self.length):
+            yield self.values[(self.start + i) % self.capacity]
+
+    def append(self, value):
+        """
+        値を追加する。容量を超えた場合は一番古い値を捨てる。
+
+        :param value: 値
+        :return: なし
+        """
+        if self.length < self.capacity:
+            self.values[(self.start + self.length) % self.capacity] = value
+            self.length += 1
+        else:
+            old = self.values[self.start]
+            self.total -= old
+            self.square_total -= old * old
+
+            self.values[self.start] = value
+            self.start = (self.start + 1) % self.capacity
+
+        self.total += value
+        self.square_total += value * value
+
+        self.appended_since_resum += 1
+        if self.appended_since_resum >= self.capacity:
+            self.resum()
+
+    def resum(self):
+        """
+        合計と二乗の合計を計算し直す。
+
+        :return: なし
+        """
+        self.total = math.fsum(self)
+        self.square_total = math.fsum(x * x for x in self)
+        self.appended_since_resum = 0
+
+    def clear(self):
+        """
+        すべての値を捨てる。
+
+        :return: なし
+        """
+        self.start = 0
+        self.length = 0
+        self.total = 0.0
+        self.square_total = 0.0
+        self.appended_since_resum = 0
+
+    def mean(self):
+        """
+        平均を求める。
+
+        :return: 平均。値がない場合は0
+        """
+        if self.length == 0:
+            return 0
+
+        return self.total / self.length
+
+    def variance(self):
+        """
+        分散を求める。
+
+        :return: 分散。値がない場合は0
+        """
+        if self.length == 0:
+            return 0
+
+        mean = self.total / self.length
+        return max(self.square_total / self.length - mean * mean, 0.0)
+
+    def percentile(self, percent):
+        """
+        パーセンタイルを求める。並べ替えるのでO(n log n)かかる。
+
+        :param percent: 0～100
+        :return: パーセンタイル(線形補間)。値がない場合は0
+        """
+        if self.length == 0:
+            return 0
+
+        return get_percentile(sorted(self), percent)
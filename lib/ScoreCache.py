@@ -0,0 +1,145 @@
+##################################
+#                                #
+#   loxygenK/musical_typer       #
+#   コンパイル済み譜面キャッシュ #
+#   (c)2020 loxygenK             #
+#      All rights reversed.       #
+#                                #
+##################################
+
+import hashlib
+import os
+import pickle
+import struct
+import tempfile
+
+# キャッシュを保存するディレクトリ
+CACHE_DIR = "score_cache"
+
+# 形式を変えたら上げる
+CACHE_VERSION = 4
+
+# ヘッダ: マジックナンバー, バージョン, 譜面の更新時刻(ns), 譜面のサイズ, 譜面のSHA-1
+HEADER = struct.Struct("<4sIqq20s")
+MAGIC = b"MTSC"
+
+
+def get_cache_path(file_name):
+    """
+    譜面ファイルに対応するキャッシュファイルのパスを取得する。
+
+    :param file_name: 譜面ファイル
+    :return: キャッシュファイルのパス
+    """
+    key = hashlib.sha1(os.path.abspath(file_name).encode("utf-8")).hexdigest()
+    return os.path.join(CACHE_DIR, key + ".bin")
+
+
+def get_file_hash(file_name):
+    """
+    ファイルの内容のSHA-1を求める。
+
+    :param file_name: ファイル
+    :return: SHA-1(20バイト)
+    """
+    with open(file_name, mode="rb") as f:
+        return hashlib.sha1(f.read()).digest()
+
+
+def refresh_header(file_name, stat, digest):
+    """
+    キャッシュのヘッダの更新時刻を書き換える。書き換えられなくても何もしない。
+
+    :param file_name: 譜面ファイル
+    :param stat: 譜面ファイルのos.stat()の結果
+    :param digest: 譜面のSHA-1
+    :return: なし
+    """
+    try:
+        with open(get_cache_path(file_name), mode="r+b") as f:
+            f.write(HEADER.pack(MAGIC, CACHE_VERSION, stat.st_mtime_ns, stat.st_size, digest))
+    except OSError:
+        pass
+
+
+def load(score, file_name):
+    """
+    キャッシュから譜面データを読み込み、scoreに値をセットする。
+    譜面の更新時刻とサイズが一致すればそのまま使い(ハッシュはヘッダのものを使う)、
+    更新時刻だけが違う場合は内容のハッシュを比べる。
+
+    :param score: 値をセットするScore
+    :param file_name: 譜面ファイル
+    :return: (キャッシュから読み込めた場合はTrue, 譜面のSHA-1。求めていない場合はNone)
+    """
+    try:
+        stat = os.stat(file_name)
+        with open(get_cache_path(file_name), mode="rb") as f:
+            data = f.read()
+    except OSError:
+        return False, None
+
+    if len(data) < HEADER.size:
+        return False, None
+
+    magic, version, mtime, size, digest = HEADER.unpack_from(data)
+    if magic != MAGIC or version != CACHE_VERSION or size != stat.st_size:
+        return False, None
+
+    # 更新時刻が違っても、内容が同じならそのまま使える
+    if mtime != stat.st_mtime_ns:
+        file_hash = get_file_hash(file_name)
+        if digest != file_hash:
+            return False, file_hash
+
+        # 次からハッシュを求めなくて済むように、ヘッダの更新時刻を今のものにする
+        refresh_header(file_name, stat, digest)
+
+    try:
+        properties, log, lyrics, zone, section, typing = pickle.loads(data[HEADER.size:])
+    except (pickle.UnpicklingError, EOFError, ValueError, TypeError, AttributeError, ImportError):
+        return False, digest
+
+    score.properties = properties
+    score.log = log
+    score.score = lyrics
+    score.zone = zone
+    score.section = section
+    score.typing = typing
+    score.build_index()
+
+    return True, digest
+
+
+def save(score, file_name, file_hash):
+    """
+    譜面データをキャッシュに保存する。保存に失敗しても何もしない。
+
+    :param score: 保存するScore
+    :param file_name: 譜面ファイル
+    :param file_hash: 譜面のSHA-1
+    :return: なし
+    """
+    temp_path = None
+    try:
+        stat = os.stat(file_name)
+        header = HEADER.pack(MAGIC, CACHE_VERSION, stat.st_mtime_ns, stat.st_size, file_hash)
+        payload = pickle.dumps(
+            (score.properties, score.log, score.score, score.zone, score.section, score.typing),
+            protocol=pickle.HIGHEST_PROTOCOL
+        )
+
+        os.makedirs(CACHE_DIR, exist_ok=True)
+
+        # 書き込み途中のファイルを読まないように、別名で書いてから置き換える
+        # (別のスレッドやプロセスが同じ譜面を保存しても、一時ファイルがぶつからないようにする)
+        with tempfile.NamedTemporaryFile(dir=CACHE_DIR, suffix=".tmp", delete=False) as f:
+            temp_path = f.name
+            f.write(header + payload)
+        os.replace(temp_path, get_cache_path(file_name))
+    except OSError:
+        if temp_path is not None:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
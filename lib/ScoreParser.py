@@ -0,0 +1,292 @@
+##############################
+#                            #
+#   loxygenK/musical_typer   #
+#   譜面パーサー             #
+#   (c)2020 loxygenK         #
+#      All rights reversed.   #
+#                            #
+##############################
+
+import re
+
+from chardet.universaldetector import UniversalDetector
+
+# イベントの種類
+EVENT_PROPERTY = "property"
+EVENT_START = "start"
+EVENT_TIME = "time"
+EVENT_LYRIC = "lyric"
+EVENT_KANA = "kana"
+EVENT_CAPTION = "caption"
+EVENT_BREAK = "break"
+EVENT_END = "end"
+EVENT_SECTION = "section"
+EVENT_ZONE = "zone"
+EVENT_ERROR = "error"
+EVENT_WARNING = "warning"
+
+# エンコードの判別に使う読み込み単位
+DETECT_CHUNK_SIZE = 4096
+
+re_rect_bracket = re.compile(r"\[(.*)\]")
+
+
+class ScoreEvent:
+    """
+    譜面の一行から得られたイベント。
+
+    kindごとのvalue:
+        EVENT_PROPERTY: (名前, 値)
+        EVENT_TIME: 時間[秒](分指定を含めた絶対時間)
+        EVENT_LYRIC / EVENT_KANA / EVENT_CAPTION: 文字列
+        EVENT_SECTION: セクション名
+        EVENT_ZONE: (ゾーン名, "start" または "end")
+        EVENT_ERROR / EVENT_WARNING: メッセージ
+        それ以外: None
+    """
+
+    __slots__ = ("kind", "line", "column", "value")
+
+    def __init__(self, kind, line, column, value=None):
+        self.kind = kind
+        self.line = line
+        self.column = column
+        self.value = value
+
+    def __repr__(self):
+        return "ScoreEvent({!r}, {}, {}, {!r})".format(self.kind, self.line, self.column, self.value)
+
+
+class ParserState:
+    """
+    行の頭でのパーサーの状態。途中の行から読み直すときに使う。
+    """
+
+    __slots__ = ("is_in_song", "current_minute")
+
+    def __init__(self, is_in_song=False, current_minute=0):
+        self.is_in_song = is_in_song
+        self.current_minute = current_minute
+
+
+def detect_encoding(file_name):
+    """
+    ファイルのエンコードを判別する。判別できた時点で読むのをやめる。
+
+    :param file_name: ファイル
+    :return: エンコード
+    """
+    detector = UniversalDetector()
+    with open(file_name, mode="rb") as f:
+        for chunk in iter(lambda: f.read(DETECT_CHUNK_SIZE), b""):
+            detector.feed(chunk)
+            if detector.done:
+                break
+    detector.close()
+
+    return detector.result["encoding"] or "utf-8"
+
+
+def read_lines(file_name, encoding):
+    """
+    ファイルを一行ずつ読む。
+
+    :param file_name: ファイル
+    :param encoding: エンコード
+    :return: 行(改行を含む)を返すジェネレータ
+    """
+    with open(file_name, mode="r", encoding=encoding) as f:
+        for line in f:
+            yield line
+
+
+def parse_lines(lines, state=None, first_line=1, states=None):
+    """
+    譜面を一行ずつパースし、イベントを返す。
+    エラーがあってもそこで止めず、EVENT_ERROR／EVENT_WARNINGとして返して続ける。
+
+    :param lines: 行のイテラブル
+    :param state: パースを始める行の頭での状態。省略するとファイルの先頭の状態
+    :param first_line: linesの最初の行の行番号(1始まり)
+    :param states: 指定すると、各行の頭での状態と、最後の行の次の状態をこのリストに追加する
+    :return: ScoreEventを返すジェネレータ
+    """
+    is_in_song = state.is_in_song if state is not None else False
+    current_minute = state.current_minute if state is not None else 0
+
+    line_number = first_line - 1
+    for raw_line in lines:
+        line_number += 1
+
+        if states is not None:
+            states.append(ParserState(is_in_song, current_minute))
+
+        line = raw_line.strip()
+
+        # ----- 処理対象行かの確認
+
+        # コメント／空行
+        if len(line) == 0 or line.startswith("#"):
+            continue
+
+        # 行頭の空白を飛ばした位置(1始まり)
+        column = len(raw_line) - len(raw_line.lstrip()) + 1
+
+        # カギカッコ
+        rect_blk_match = re_rect_bracket.match(line)
+
+        # ----- 曲外での処理
+
+        if not is_in_song:
+
+            # 曲に関するプロパティ
+            if line.startswith(":"):
+                pair = line[1:].split(None, 1)
+                if len(pair) != 2:
+                    yield ScoreEvent(EVENT_ERROR, line_number, column, "Property needs a name and a value")
+                else:
+                    yield ScoreEvent(EVENT_PROPERTY, line_number, column, (pair[0], pair[1]))
+                continue
+
+            # 曲開始コマンド?
+            if rect_blk_match is not None and rect_blk_match[1] == "start":
+                is_in_song = True
+                yield ScoreEvent(EVENT_START, line_number, column)
+                continue
+
+            # 上記の条件にヒットしない文字列は、
+            # 曲データの外では許可されない
+            yield ScoreEvent(EVENT_ERROR, line_number, column, "Unknown text outside song section")
+            continue
+
+        # ----- 曲内での処理
+
+        # カギカッコで囲まれているか
+        if rect_blk_match is not None:
+            command = rect_blk_match[1]
+            # 間奏などで歌詞データがない
+            if command == "break":
+                yield ScoreEvent(EVENT_BREAK, line_number, column)
+                continue
+            if command == "end":
+                is_in_song = False
+                yield ScoreEvent(EVENT_END, line_number, column)
+                continue
+
+            yield ScoreEvent(EVENT_WARNING, line_number, column, "Unknown command is treated as lyrics")
+
+        # 歌詞のみ(キャプションなど)
+        if line.startswith(">>"):
+            yield ScoreEvent(EVENT_CAPTION, line_number, column, line[2:])
+            continue
+
+        # 分指定演算子
+        if line.startswith("|"):
+            try:
+                current_minute = int(line[1:])
+            except ValueError:
+                yield ScoreEvent(EVENT_ERROR, line_number, column + 1, "Minute is not an integer")
+            continue
+
+        # 秒指定演算子
+        if line.startswith("*"):
+            try:
+                yield ScoreEvent(EVENT_TIME, line_number, column, 60 * current_minute + float(line[1:]))
+            except ValueError:
+                yield ScoreEvent(EVENT_ERROR, line_number, column + 1, "Time is not a number")
+            continue
+
+        # セクション演算子
+        if line.startswith("@"):
+            yield ScoreEvent(EVENT_SECTION, line_number, column, line[1:])
+            continue
+
+        # ゾーン演算子("!start name"と"!name start"のどちらでもよい)
+        if line.startswith("!"):
+            words = line[1:].split()
+            if len(words) != 2 or not (words[0] in ("start", "end") or words[1] in ("start", "end")):
+                yield ScoreEvent(EVENT_ERROR, line_number, column + 1, "Zone needs a name and start or end")
+                continue
+
+            if words[0] in ("start", "end"):
+                flag, zone_name = words
+            else:
+                zone_name, flag = words
+
+            yield ScoreEvent(EVENT_ZONE, line_number, column, (zone_name, flag))
+            continue
+
+        # ふりがなデータ
+        if line.startswith(":"):
+            yield ScoreEvent(EVENT_KANA, line_number, column, line[1:])
+            continue
+
+        # 特に何もなければそれは歌詞
+        yield ScoreEvent(EVENT_LYRIC, line_number, column, line)
+
+    # 最後の行の次の状態(行を追加してパースし直すときに使う)
+    if states is not None:
+        states.append(ParserState(is_in_song, current_minute))
+
+
+def validate_events(events):
+    """
+    一行だけでは分からない譜面のエラー・警告を、イベントの間に加える。
+    Score.apply_eventsとSongLibrary.scan_scoreはどちらもこれを通したイベントを使うので、判定はここにまとめる。
+
+    - 歌詞にふりがながない: 次のEVENT_TIMEの前にEVENT_ERROR(その歌詞は譜面に入れない)
+    - 時間が戻る: EVENT_ERRORを加え、そのEVENT_TIMEは直前の時間に置き換える(表が時間順のままになるように)
+    - 最後の時間指定の後に歌詞がある: 最後にEVENT_WARNING
+    - 曲が指定されていない: 最後にEVENT_ERROR
+
+    :param events: ScoreEventのイテラブル
+    :return: ScoreEventを返すジェネレータ
+    """
+    current_time = 0
+    has_song = False
+
+    # 次の時間指定で確定する歌詞があるか／ふりがながあるか／最初の歌詞の位置
+    has_lyric = False
+    has_kana = False
+    lyric_line = 0
+    lyric_column = 0
+
+    for event in events:
+        kind = event.kind
+
+        if kind == EVENT_PROPERTY:
+            if event.value[0] == "song_data":
+                has_song = True
+
+        elif kind == EVENT_LYRIC:
+            if not has_lyric:
+                lyric_line = event.line
+                lyric_column = event.column
+            has_lyric = True
+
+        elif kind == EVENT_KANA:
+            has_kana = True
+
+        elif kind == EVENT_TIME:
+            if has_lyric and not has_kana:
+                yield ScoreEvent(EVENT_ERROR, lyric_line, lyric_column, "No pronunciation data")
+
+            has_lyric = False
+            has_kana = False
+
+            # 二分探索できなくなるので、時間は戻ってはいけない
+            if event.value < current_time:
+                yield ScoreEvent(EVENT_ERROR, event.line, event.column, "Time goes backwards")
+                event = ScoreEvent(EVENT_TIME, event.line, event.column, current_time)
+
+            current_time = event.value
+
+        yield event
+
+    # 時間が指定されなかった歌詞は書き込まれない
+    if has_lyric:
+        yield ScoreEvent(EVENT_WARNING, lyric_line, lyric_column, "Lyrics without a following time are ignored")
+
+    # 曲が指定されていない譜面は遊べない
+    if not has_song:
+        yield ScoreEvent(EVENT_ERROR, 0, 0, "Song is not specified")
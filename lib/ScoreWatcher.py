@@ -0,0 +1,62 @@
+##############################
+#                            #
+#   loxygenK/musical_typer   #
+#   譜面の変更の監視         #
+#   (c)2020 loxygenK         #
+#      All rights reversed.   #
+#                            #
+##############################
+
+import os
+import time
+
+
+class ScoreWatcher:
+    """
+    譜面ファイルの更新時刻と大きさを一定間隔で調べ、変更されたかを知らせる。
+    """
+
+    # 調べる間隔[秒]
+    POLL_INTERVAL = 0.25
+
+    def __init__(self, file_name):
+        """
+        監視を始める。
+
+        :param file_name: 譜面ファイル
+        """
+        self.file_name = file_name
+        self.signature = self.get_signature()
+        self.next_poll = time.perf_counter() + ScoreWatcher.POLL_INTERVAL
+
+    def get_signature(self):
+        """
+        ファイルの更新時刻と大きさを取得する。
+
+        :return: (更新時刻[ns], 大きさ)。保存の途中などで読めない場合はNone
+        """
+        try:
+            stat = os.stat(self.file_name)
+        except OSError:
+            return None
+
+        return stat.st_mtime_ns, stat.st_size
+
+    def poll(self):
+        """
+        前回変更を知らせてからファイルが変更されたかを調べる。POLL_INTERVALより頻繁には調べない。
+
+        :return: 変更された場合はTrue
+        """
+        now = time.perf_counter()
+        if now < self.next_poll:
+            return False
+
+        self.next_poll = now + ScoreWatcher.POLL_INTERVAL
+
+        signature = self.get_signature()
+        if signature is None or signature == self.signature:
+            return False
+
+        self.signature = signature
+        return True
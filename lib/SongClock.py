@@ -0,0 +1,129 @@
+##############################
+#                            #
+#   loxygenK/musical_typer   #
+#   曲の時計                 #
+#   (c)2020 loxygenK         #
+#      All rights reversed.   #
+#                            #
+##############################
+
+import time
+
+import pygame
+
+
+def get_mixer_pos():
+    """
+    ミキサーの再生位置を取得する。
+
+    :return: 再生位置[秒]。再生していない場合は負
+    """
+    return pygame.mixer.music.get_pos() / 1000
+
+
+class SongClock:
+    """
+    曲上の現在位置を求める時計。
+    ミキサーの再生位置はバッファ単位でしか進まないので、その間はperf_counterで補間し、
+    再生位置が更新されるたびに少しずつずれを補正する。
+    譜面のオフセットと、遅延の補正値も反映する。
+    """
+
+    # ずれがこれ[秒]を超えたら、補正せずにミキサーの再生位置に合わせ直す
+    SNAP_THRESHOLD = 0.1
+
+    # 一回の補正でずれの何割を詰めるか
+    CORRECTION_RATE = 0.1
+
+    def __init__(self, offset=0.0, latency=0.0, mixer_pos_getter=get_mixer_pos):
+        """
+        時計を初期化する。
+
+        :param offset: 譜面のオフセット[秒]。曲のこの位置を譜面の0秒とする
+        :param latency: 遅延の補正値[秒]。音が聞こえるまでの遅れの分だけ、曲上の位置を戻す
+        :param mixer_pos_getter: 再生位置[秒]を返す関数
+        """
+        self.offset = offset
+        self.latency = latency
+        self.mixer_pos_getter = mixer_pos_getter
+
+        # 再生を始めた位置(ミキサーの再生位置は、再生を始めてからの時間しか返さない)
+        self.start_pos = 0.0
+
+        # 補間の基準にする再生位置と、そのときのperf_counter
+        self.base_pos = 0.0
+        self.base_time = time.perf_counter()
+
+        # 最後に読んだミキサーの再生位置／最後に返した曲上の位置
+        self.last_mixer_pos = 0.0
+        self.last_pos = None
+
+    def start(self, start_pos=0.0):
+        """
+        再生を始めたときに呼ぶ。補間の基準を今にする。
+
+        :param start_pos: 曲のどの位置[秒]から再生を始めたか
+        :return: なし
+        """
+        self.start_pos = start_pos
+        self.base_pos = start_pos
+        self.base_time = time.perf_counter()
+        self.last_mixer_pos = 0.0
+        self.last_pos = None
+
+    def is_playing(self):
+        """
+        曲が再生中か。
+
+        :return: 再生中ならTrue
+        """
+        return self.mixer_pos_getter() >= 0
+
+    def sync(self, now):
+        """
+        ミキサーの再生位置が更新されていたら、補間した位置とのずれを補正する。
+
+        :param now: 現在のperf_counter
+        :return: なし
+        """
+        mixer_pos = self.mixer_pos_getter()
+        if mixer_pos < 0 or mixer_pos == self.last_mixer_pos:
+            return
+
+        self.last_mixer_pos = mixer_pos
+        mixer_pos += self.start_pos
+
+        estimate = self.base_pos + (now - self.base_time)
+        error = mixer_pos - estimate
+
+        if abs(error) > SongClock.SNAP_THRESHOLD:
+            self.base_pos = mixer_pos
+        else:
+            self.base_pos = estimate + error * SongClock.CORRECTION_RATE
+
+        self.base_time = now
+
+    def get_pos_at(self, at):
+        """
+        指定したperf_counterの時点での、曲上の位置を求める。syncはしない。
+
+        :param at: perf_counterの値
+        :return: 曲上の位置[秒]
+        """
+        return self.base_pos + (at - self.base_time) - self.offset - self.latency
+
+    def get_pos(self):
+        """
+        曲上の現在位置を求める。戻ることはない。
+
+        :return: 曲上の位置[秒]
+        """
+        now = time.perf_counter()
+        self.sync(now)
+
+        pos = self.get_pos_at(now)
+        if self.last_pos is not None and pos < self.last_pos:
+            pos = self.last_pos
+
+        self.last_pos = pos
+        return pos
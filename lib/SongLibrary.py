@@ -0,0 +1,243 @@
+##############################
+#                            #
+#   loxygenK/musical_typer   #
+#   曲の一覧のインデックス   #
+#   (c)2020 loxygenK         #
+#      All rights reversed.   #
+#                            #
+##############################
+
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+
+from lib import Romautil, ScoreParser
+
+# インデックスを保存するファイル
+INDEX_FILE = "library.sqlite3"
+
+# 譜面ファイルの拡張子
+SCORE_EXTENSION = ".tsc"
+
+# 形式を変えたら上げる(SQLiteのuser_versionに保存する)
+INDEX_VERSION = 3
+
+# 一覧に表示するプロパティ
+PROPERTY_NAMES = ("title", "song_author", "singer", "score_author", "bpm", "song_data")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS songs (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    title TEXT,
+    song_author TEXT,
+    singer TEXT,
+    score_author TEXT,
+    bpm TEXT,
+    song_data TEXT,
+    duration REAL NOT NULL,
+    lyric_count INTEGER NOT NULL,
+    roma_length INTEGER NOT NULL,
+    has_error INTEGER NOT NULL
+)
+"""
+
+
+class SongEntry:
+    """
+    インデックスに登録された一曲分の情報。
+    """
+
+    __slots__ = ("path", "properties", "duration", "lyric_count", "roma_length", "has_error")
+
+    def __init__(self, path, properties, duration, lyric_count, roma_length, has_error):
+        self.path = path
+        self.properties = properties
+        self.duration = duration
+        self.lyric_count = lyric_count
+        self.roma_length = roma_length
+        self.has_error = has_error
+
+    @property
+    def title(self):
+        """
+        曲のタイトル。指定されていない場合はファイル名。
+
+        :return: タイトル
+        """
+        return self.properties.get("title") or os.path.basename(self.path)
+
+    def get_key_per_second(self):
+        """
+        曲全体を通して必要なタイプ速度を求める。難しさの目安にする。
+
+        :return: ローマ字の数／曲の長さ[文字/秒]。長さがない場合は0
+        """
+        if self.duration <= 0:
+            return 0
+
+        return self.roma_length / self.duration
+
+
+def scan_score(file_name):
+    """
+    譜面ファイルのプロパティと、曲の長さ・歌詞の数・ローマ字の数を調べる。
+    Score.read_scoreと違い、イベントを数えるだけでタイプ判定用のオートマトンも曲も読み込まない。
+
+    :param file_name: 譜面ファイル
+    :return: (プロパティの辞書, 曲の長さ[秒], 歌詞の数, ローマ字の数, エラーがあるか)
+    """
+    properties = {}
+    duration = 0
+    lyric_count = 0
+    roma_length = 0
+    has_error = False
+
+    # 歌詞とふりがなは次の時間指定で確定する
+    lyric = ""
+    kana = ""
+
+    try:
+        encoding = ScoreParser.detect_encoding(file_name)
+        events = list(ScoreParser.parse_lines(ScoreParser.read_lines(file_name, encoding)))
+    except (OSError, UnicodeError, LookupError):
+        # 読めない譜面(エンコードの名前が分からない場合も)もエラーとして一覧に載せる
+        return properties, duration, lyric_count, roma_length, True
+
+    # Score.read_scoreでエラーになる譜面は、validate_eventsがエラーのイベントを加えてくれる
+    for event in ScoreParser.validate_events(events):
+        kind = event.kind
+
+        if kind == ScoreParser.EVENT_PROPERTY:
+            properties[event.value[0]] = event.value[1]
+
+        elif kind == ScoreParser.EVENT_TIME:
+            if len(lyric) != 0 and len(kana) != 0:
+                lyric_count += 1
+                roma_length += len(Romautil.hira2roma(kana))
+            lyric = ""
+            kana = ""
+
+            duration = max(duration, event.value)
+
+        elif kind == ScoreParser.EVENT_LYRIC:
+            lyric += event.value
+
+        elif kind == ScoreParser.EVENT_KANA:
+            kana += event.value
+
+        elif kind == ScoreParser.EVENT_ERROR:
+            has_error = True
+
+    return properties, duration, lyric_count, roma_length, has_error
+
+
+def find_scores(directory):
+    """
+    ディレクトリ以下(サブディレクトリを含む)の譜面ファイルを探す。
+
+    :param directory: ディレクトリ
+    :return: 譜面ファイルの絶対パスと、(更新時刻[ns], 大きさ)の辞書
+    """
+    found = {}
+    for root, dirs, files in os.walk(directory):
+        for name in files:
+            if not name.endswith(SCORE_EXTENSION):
+                continue
+
+            path = os.path.abspath(os.path.join(root, name))
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+
+            found[path] = (stat.st_mtime_ns, stat.st_size)
+
+    return found
+
+
+class SongLibrary:
+    """
+    譜面ファイルのプロパティなどをSQLiteに保存しておき、曲選択のたびに全部の譜面を読まなくて済むようにする。
+    インデックスは更新時刻と大きさが変わった譜面だけを、複数のプロセスで並列に調べ直して更新する。
+    """
+
+    def __init__(self, index_file=INDEX_FILE):
+        """
+        インデックスを開く。形式が古い場合は作り直す。
+
+        :param index_file: インデックスのファイル
+        """
+        self.connection = sqlite3.connect(index_file)
+
+        if self.connection.execute("PRAGMA user_version").fetchone()[0] != INDEX_VERSION:
+            self.connection.execute("DROP TABLE IF EXISTS songs")
+            self.connection.execute("PRAGMA user_version = {}".format(INDEX_VERSION))
+
+        self.connection.execute(SCHEMA)
+        self.connection.commit()
+
+    def close(self):
+        """
+        インデックスを閉じる。
+
+        :return: なし
+        """
+        self.connection.close()
+
+    def update(self, directory, workers=None):
+        """
+        ディレクトリ以下の譜面をインデックスに反映する。
+        追加・変更された譜面だけを調べ直し、なくなった譜面は削除する。
+
+        :param directory: 譜面を探すディレクトリ
+        :param workers: 並列に調べるプロセスの数(デフォルト: CPUの数)
+        :return: (調べ直した譜面の数, 削除した譜面の数)
+        """
+        found = find_scores(directory)
+        indexed = {path: (mtime, size) for path, mtime, size in
+                   self.connection.execute("SELECT path, mtime_ns, size FROM songs")}
+
+        root = os.path.join(os.path.abspath(directory), "")
+        removed = [path for path in indexed if path not in found and path.startswith(root)]
+        changed = [path for path, signature in found.items() if indexed.get(path) != signature]
+
+        # 調べる譜面が一つなら、プロセスを立ち上げるほうが遅い
+        if len(changed) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(scan_score, changed))
+        else:
+            results = [scan_score(path) for path in changed]
+
+        with self.connection:
+            self.connection.executemany("DELETE FROM songs WHERE path = ?", [(path,) for path in removed])
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO songs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(path, found[path][0], found[path][1]) +
+                 tuple(properties.get(name) for name in PROPERTY_NAMES) +
+                 (duration, lyric_count, roma_length, int(has_error))
+                 for path, (properties, duration, lyric_count, roma_length, has_error) in zip(changed, results)]
+            )
+
+        return len(changed), len(removed)
+
+    def get_songs(self, directory="."):
+        """
+        インデックスに登録されている曲を、タイトル順に取得する。
+
+        :param directory: 指定すると、このディレクトリ以下の曲だけを取得する
+        :return: SongEntryのリスト
+        """
+        root = os.path.join(os.path.abspath(directory), "")
+
+        songs = []
+        for row in self.connection.execute("SELECT * FROM songs ORDER BY title, path"):
+            path = row[0]
+            if not path.startswith(root):
+                continue
+
+            properties = {name: value for name, value in zip(PROPERTY_NAMES, row[3:9]) if value is not None}
+            songs.append(SongEntry(path, properties, row[9], row[10], row[11], bool(row[12])))
+
+        return songs
@@ -0,0 +1,232 @@
+##################################
+#                                #
+#   loxygenK/musical_typer       #
+#   タイピング判定オートマトン   #
+#   (c)2020 loxygenK             #
+#      All rights reversed.       #
+#                                #
+##################################
+
+import romkan
+
+from lib import Romautil
+
+# 拗音などで前の文字とくっつく小さい文字
+SMALL_KANA = "ゃゅょぁぃぅぇぉゎ"
+
+# 母音(とy)から始まる文字の前では「ん」を「n」一つで打てない
+VOWEL_LIKE = "aiueoyn"
+
+# romkanが返さないけど許容する表記
+EXTRA_SPELLINGS = {
+    "し": ["ci"],
+    "か": ["ca"],
+    "く": ["cu", "qu"],
+    "こ": ["co"],
+    "せ": ["ce"],
+    "ぢ": ["di"],
+    "づ": ["du", "dzu"],
+    "ゔ": ["vu"],
+    "じゃ": ["jya"],
+    "じゅ": ["jyu"],
+    "じょ": ["jyo"],
+    "ちゃ": ["cya"],
+    "ちゅ": ["cyu"],
+    "ちょ": ["cyo"],
+}
+
+
+class TypingAutomaton:
+    """
+    ひらがな一文を、受け付けるすべてのローマ字表記を判定できる決定性オートマトンにしたもの。
+    訓令式／ヘボン式／「l」「x」始まりの小さい文字／「nn」「n'」／子音を重ねる「っ」を受け付ける。
+
+    状態は整数で表し、0が初期状態。キーを受け付けない場合、next_state()は-1を返す。
+    """
+
+    START = 0
+
+    def __init__(self, kana):
+        """
+        ひらがなからオートマトンを作成する。
+
+        :param kana: ひらがな
+        """
+        self.kana = kana
+
+        # 状態ごとの遷移表／残りのローマ字／残りのひらがな／ひらがなの途中か
+        self.transitions = []
+        self.remaining_roma = []
+        self.remaining_kana = []
+        self.kana_position = []
+        self.halfway = []
+
+        self._compile()
+
+    def next_state(self, state, key):
+        """
+        キーを打ったときの次の状態を取得する。
+
+        :param state: 現在の状態
+        :param key: タイプされたキー
+        :return: 次の状態。キーを受け付けない場合は-1
+        """
+        return self.transitions[state].get(key, -1)
+
+    def is_completed(self, state):
+        """
+        最後まで打ち終わったかを確認する。
+
+        :param state: 状態
+        :return: 打ち終わっている場合はTrue
+        """
+        return len(self.remaining_roma[state]) == 0
+
+    def _compile(self):
+        """
+        オートマトンを作成する。
+
+        :return: なし
+        """
+        alternatives = get_alternatives(self.kana)
+
+        # 位置ごとの標準的な表記(一番目の候補をつなげたもの)
+        canonical = [""] * (len(self.kana) + 1)
+        for p in range(len(self.kana) - 1, -1, -1):
+            spelling, next_position = alternatives[p][0]
+            canonical[p] = spelling + canonical[next_position]
+
+        # 非決定性オートマトンの状態 (位置, その位置で打ったローマ字) の集合を
+        # 一つの状態にまとめていく
+        state_id = {}
+        queue = []
+
+        def register(nfa_states):
+            if nfa_states not in state_id:
+                state_id[nfa_states] = len(queue)
+                queue.append(nfa_states)
+            return state_id[nfa_states]
+
+        register(frozenset([(0, "")]))
+
+        i = 0
+        while i < len(queue):
+            nfa_states = queue[i]
+            i += 1
+
+            # 次の状態を求める
+            next_states = {}
+            for position, typed in nfa_states:
+                if position >= len(self.kana):
+                    continue
+                for spelling, next_position in alternatives[position]:
+                    if len(spelling) <= len(typed) or not spelling.startswith(typed):
+                        continue
+
+                    key = spelling[len(typed)]
+                    if len(spelling) == len(typed) + 1:
+                        next_states.setdefault(key, set()).add((next_position, ""))
+                    else:
+                        next_states.setdefault(key, set()).add((position, typed + key))
+
+            self.transitions.append({k: register(frozenset(v)) for k, v in next_states.items()})
+
+            # 表示用の情報は、一番打ち進んでいるものを代表にして求める
+            remain, halfway, position = min(
+                (remaining(alternatives, canonical, p, t), len(t) > 0, p) for p, t in nfa_states
+            )
+            self.remaining_roma.append(remain)
+            self.remaining_kana.append(self.kana[position:])
+            self.kana_position.append(position)
+            self.halfway.append(halfway)
+
+
+def remaining(alternatives, canonical, position, typed):
+    """
+    位置と、その位置で打ったローマ字から、残りのローマ字を求める。
+
+    :param alternatives: get_alternatives()の結果
+    :param canonical: 位置ごとの標準的な表記
+    :param position: 位置
+    :param typed: その位置で打ったローマ字
+    :return: 残りのローマ字
+    """
+    if position >= len(alternatives):
+        return ""
+
+    for spelling, next_position in alternatives[position]:
+        if spelling.startswith(typed):
+            return spelling[len(typed):] + canonical[next_position]
+
+    return canonical[position]
+
+
+def get_alternatives(kana):
+    """
+    ひらがなの各位置から始まる表記の候補を求める。後ろから求めていく。
+
+    :param kana: ひらがな
+    :return: 位置ごとの (表記, 次の位置) のリスト。一番目が標準的な表記
+    """
+    alternatives = [[] for _ in range(len(kana))]
+
+    for p in range(len(kana) - 1, -1, -1):
+        char = kana[p]
+        candidates = []
+
+        if char == "っ":
+            # 次の文字の子音を重ねる
+            if p + 1 < len(kana):
+                for spelling, next_position in alternatives[p + 1]:
+                    if spelling[:1].isascii() and spelling[:1].isalpha() and spelling[:1] not in "aiueon":
+                        candidates.append((spelling[0] + spelling, next_position))
+
+            for spelling in ["xtu", "ltu", "xtsu", "ltsu"]:
+                candidates.append((spelling, p + 1))
+
+        elif char == "ん":
+            # 次の文字が母音などで始まらなければ「n」一つでよい
+            is_single_n_allowed = p + 1 >= len(kana) or all(
+                spelling[:1] not in VOWEL_LIKE for spelling, _ in alternatives[p + 1]
+            )
+
+            if is_single_n_allowed:
+                candidates.append(("n", p + 1))
+            for spelling in ["nn", "n'", "xn"]:
+                candidates.append((spelling, p + 1))
+
+        else:
+            # 拗音など、二文字で一つの音節
+            if p + 1 < len(kana) and kana[p + 1] in SMALL_KANA:
+                syllable = kana[p:p + 2]
+                for spelling in get_spellings(syllable):
+                    # 「texi」など、一文字ずつ打つのと同じものは除く
+                    if "x" not in spelling:
+                        candidates.append((spelling, p + 2))
+
+            for spelling in get_spellings(char):
+                candidates.append((spelling, p + 1))
+
+        # 重複を取り除く
+        alternatives[p] = list(dict.fromkeys(candidates))
+
+    return alternatives
+
+
+def get_spellings(syllable):
+    """
+    音節のローマ字表記を、標準的なものから順番に取得する。
+
+    :param syllable: 音節(ひらがな一～二文字)
+    :return: ローマ字表記のリスト
+    """
+    spellings = [
+        Romautil.hira2roma(syllable),
+        romkan.to_kunrei(syllable),
+        romkan.to_hepburn(syllable),
+    ] + EXTRA_SPELLINGS.get(syllable, [])
+
+    # 小さい文字は「x」でも「l」でもOK
+    spellings += ["l" + x[1:] for x in spellings if x[:1] == "x"]
+
+    return [x for x in dict.fromkeys(spellings) if len(x) > 0]